@@ -0,0 +1,205 @@
+'''
+Benchmarks for the metrics, comparator and Shapelet extraction paths.
+
+Every case runs on synthetic series of configurable length and count, and reports its
+timings and peak memory as JSON, so that results can be compared across versions:
+
+    $ python benchmarks/bench.py --length 150 --count 200 --cores 4 --output results.json
+    $ python benchmarks/bench.py --only metrics
+
+Each record holds the case name, its group, the parameters, the cold and warm wall
+times, the peak memory traced during one more run, and the peak resident memory of the
+process so far.
+
+The cold time is that of a single run in a new process with an empty, temporary
+NUMBA_CACHE_DIR, so it includes compiling every numba kernel the case calls rather than
+loading them from the on-disk cache. The warm time is the median of `--repeat` runs in
+this process, after one untimed run. Pass --no-cold to skip the cold runs.
+Cases named 'cold_cache' clear the distance cache before every run; 'warm_cache'
+cases fill it first.
+'''
+import argparse, contextlib, json, os, platform, statistics, subprocess, sys, tempfile, time, tracemalloc
+import numpy as np
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import tsshapelet
+from tsshapelet import Shapelet, query, query_topk, pairwise_argmin, score, get_distance_cache
+from tsshapelet.metrics import dtw, dtw_matrix, dtw_distance, ed
+
+# --------------------------------------------------------------------------------
+# Synthetic data
+# --------------------------------------------------------------------------------
+
+def synthetic_series(length, seed = 0):
+    ''' A noisy cyclical series with a period of about 100 samples. '''
+    rng = np.random.default_rng(seed)
+    t = np.arange(length)
+    return np.sin(2*np.pi*t/100)**3 + 0.5*np.sin(2*np.pi*t/37) + 0.1*rng.normal(size = length)
+
+
+def synthetic_library(length, count, seed = 0):
+    ''' A library of count windows of the given length, cut from a synthetic series at random offsets. '''
+    rng = np.random.default_rng(seed)
+    series = synthetic_series(length * 4 + count, seed)
+    starts = rng.integers(0, len(series) - length, count)
+    return [series[s:s+length].copy() for s in starts]
+
+
+# --------------------------------------------------------------------------------
+# Runner
+# --------------------------------------------------------------------------------
+
+def measure(func, repeat, clear_cache = False):
+    '''
+    Runs func once untimed, so that its kernels are compiled or loaded, then repeat times,
+    returning the median time of the timed runs. One more run is traced with tracemalloc
+    for its peak memory, which covers numpy allocations but not those made inside numba kernels.
+    '''
+    times = []
+    for run in range(repeat + 1):
+        if clear_cache:
+            get_distance_cache().clear()
+        start = time.perf_counter()
+        func()
+        if run:
+            times.append(time.perf_counter() - start)
+
+    if clear_cache:
+        get_distance_cache().clear()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {'warm_seconds' : statistics.median(times),
+            'repeat' : repeat,
+            'peak_traced_bytes' : peak,
+            'max_rss_kb' : resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None
+            }
+
+
+def measure_cold(name, args):
+    '''
+    Runs the case once in a new process with an empty NUMBA_CACHE_DIR, returning its time,
+    which includes compiling its numba kernels.
+    '''
+    argv = [sys.executable, os.path.abspath(__file__), '--cold-case', name,
+            '--length', str(args.length), '--count', str(args.count), '--series-length', str(args.series_length),
+            '--w', str(args.w), '--cores', str(args.cores)]
+    with tempfile.TemporaryDirectory() as cache_dir:
+        result = subprocess.run(argv, env = dict(os.environ, NUMBA_CACHE_DIR = cache_dir), stdout = subprocess.PIPE, check = True)
+    return json.loads(result.stdout)['cold_seconds']
+
+
+def run_cold_case(args):
+    ''' Entry point of the process started by `measure_cold`: times one run of the case. '''
+    for group, name, params, func, clear_cache in cases(args):
+        if name == args.cold_case:
+            with contextlib.redirect_stdout(sys.stderr):
+                start = time.perf_counter()
+                func()
+                seconds = time.perf_counter() - start
+            json.dump({'cold_seconds' : seconds}, sys.stdout)
+            return
+    raise SystemExit(f'Unknown case {args.cold_case!r}.')
+
+
+def cases(args):
+    '''
+    Yields (group, name, params, func, clear_cache) for every benchmark case.
+    '''
+    length, count, cores, w = args.length, args.count, args.cores, args.w
+    C = synthetic_library(length, count)
+    q = synthetic_library(length, 1, seed = 1)[0]
+    a, b = C[0], C[1]
+    series = synthetic_series(args.series_length)
+    params = {'length' : length, 'count' : count, 'w' : w}
+
+    # Metrics
+    yield 'metrics', 'dtw_distance', params, lambda: dtw_distance(a, b, w), False
+    yield 'metrics', 'dtw_matrix', params, lambda: dtw_matrix(a, b, w), False
+    yield 'metrics', 'dtw_cold_cache', params, lambda: dtw(a, b, w = w), True
+    yield 'metrics', 'dtw_warm_cache', params, lambda: dtw(a, b, w = w), False
+    yield 'metrics', 'ed_cold_cache', params, lambda: ed(a, b), True
+    yield 'metrics', 'ed_warm_cache', params, lambda: ed(a, b), False
+
+    # Comparator, sequential and parallel
+    for metric in ('dtw', 'euclidean'):
+        p = dict(params, metric = metric)
+        yield 'comparator', f'query_{metric}', p, lambda metric = metric: query(q, C, w = w, metric = metric), True
+        yield 'comparator', f'query_topk_{metric}', p, lambda metric = metric: query_topk(q, C, k = 10, w = w, metric = metric), True
+        yield 'comparator', f'score_{metric}', p, lambda metric = metric: score(q, C, metric = metric, w = w), True
+        yield 'comparator', f'pairwise_argmin_{metric}', p, lambda metric = metric: pairwise_argmin(C, w = w, metric = metric), True
+        yield 'comparator', f'pairwise_argmin_{metric}_approximate', p, lambda metric = metric: pairwise_argmin(C, w = w, metric = metric, approximate = True, seed = 0), True
+
+        if cores > 1:
+            p = dict(p, parallel_cores = cores)
+            yield 'comparator', f'query_{metric}_parallel', p, lambda metric = metric: query(q, C, w = w, metric = metric, parallel_cores = cores), True
+            yield 'comparator', f'score_{metric}_parallel', p, lambda metric = metric: score(q, C, metric = metric, w = w, parallel_cores = cores), True
+            yield 'comparator', f'pairwise_argmin_{metric}_parallel', p, lambda metric = metric: pairwise_argmin(C, w = w, metric = metric, parallel_cores = cores), True
+
+    # Shapelet extraction
+    p = {'series_length' : args.series_length, 'w' : w}
+    qty, window, step = min(count, 200), length, max(1, length // 4)
+    yield 'shapelet', 'random_shapelet', dict(p, qty = qty), lambda: Shapelet(series).random_shapelet(qty, w = w, verbose = False), True
+    for metric in ('dtw', 'euclidean'):
+        yield 'shapelet', f'exhaustive_shapelet_{metric}', dict(p, window_length = window, step = step, metric = metric), \
+            lambda metric = metric: Shapelet(series).exhaustive_shapelet(window, step, w = w, metric = metric, verbose = False), True
+    yield 'shapelet', 'barycenter_shapelet', p, lambda: Shapelet(series).barycenter_shapelet(verbose = False), False
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = __doc__.split('\n\n')[0].strip())
+    parser.add_argument('--length', type = int, default = 150, help = 'length of each library series')
+    parser.add_argument('--count', type = int, default = 200, help = 'number of series in the library')
+    parser.add_argument('--series-length', type = int, default = 5000, help = 'length of the series for Shapelet extraction')
+    parser.add_argument('--w', type = float, default = 0.9, help = 'window constraint')
+    parser.add_argument('--cores', type = int, default = 1, help = 'parallel_cores for the parallel cases, skipped if 1')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'warm runs per case')
+    parser.add_argument('--no-cold', action = 'store_true', help = 'skip the cold runs in new processes')
+    parser.add_argument('--cold-case', help = argparse.SUPPRESS)
+    parser.add_argument('--only', choices = ['metrics', 'comparator', 'shapelet'], help = 'run a single group')
+    parser.add_argument('--output', help = 'write the JSON results to this file instead of stdout')
+    args = parser.parse_args(argv)
+
+    if args.cold_case:
+        return run_cold_case(args)
+
+    records = []
+    for group, name, params, func, clear_cache in cases(args):
+        if args.only and group != args.only:
+            continue
+        record = {'group' : group, 'name' : name, 'params' : params,
+                  'cold_seconds' : None if args.no_cold else measure_cold(name, args)}
+
+        # Keep the library's own messages out of the JSON on stdout
+        with contextlib.redirect_stdout(sys.stderr):
+            record.update(measure(func, args.repeat, clear_cache))
+
+        records.append(record)
+        cold = 'skipped' if record['cold_seconds'] is None else f"{record['cold_seconds']:.4f}s"
+        print(f"{group:>10} {name:<34} cold {cold}  warm {record['warm_seconds']:.4f}s", file = sys.stderr)
+
+    results = {'version' : getattr(tsshapelet, '__version__', None),
+               'python' : platform.python_version(),
+               'numpy' : np.__version__,
+               'platform' : platform.platform(),
+               'cpu_count' : os.cpu_count(),
+               'results' : records
+               }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 2)
+    else:
+        json.dump(results, sys.stdout, indent = 2)
+
+
+if __name__ == '__main__':
+    main()
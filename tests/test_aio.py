@@ -0,0 +1,34 @@
+import asyncio
+import numpy as np
+import pytest
+from tsshapelet import AsyncExecutor, query, query_topk, score
+
+
+def test_async_executor_matches_sequential_search():
+    rng = np.random.default_rng(0)
+    C = [np.cumsum(rng.normal(size = length)) for length in rng.integers(32, 40, size = 60)]
+    queries = [C[i][:32] + rng.normal(scale = 0.1, size = 32) for i in range(0, 60, 6)]
+
+    async def search():
+        async with AsyncExecutor(parallel_cores = 2, batch_delay = 0.01) as executor:
+            return await asyncio.gather(
+                asyncio.gather(*(executor.query(q, C, w = 0.5) for q in queries)),
+                asyncio.gather(*(executor.query_topk(q, C, k = 3, w = 0.5) for q in queries)),
+                asyncio.gather(*(executor.score(q, C, w = 0.5) for q in queries)))
+
+    indices, topk, scores = asyncio.run(search())
+    for q, index, (top, distances), row in zip(queries, indices, topk, scores):
+        assert index == query(q, C, w = 0.5)
+        expected, expected_distances = query_topk(q, C, k = 3, w = 0.5)
+        assert np.array_equal(top, expected)
+        assert np.allclose(distances, expected_distances)
+        assert np.allclose(row, score(q, C, w = 0.5))
+
+
+def test_async_executor_rejects_invalid_k():
+    async def search():
+        async with AsyncExecutor(parallel_cores = 1) as executor:
+            await executor.query_topk(np.zeros(8), [np.zeros(8)], k = 0)
+
+    with pytest.raises(ValueError):
+        asyncio.run(search())
@@ -0,0 +1,27 @@
+import numpy as np
+from tsshapelet import Shapelet, ShapeletBatch
+from tsshapelet.barycenters import dba_barycenter
+
+
+def test_batch_passes_dtype_to_each_shapelet():
+    rng = np.random.default_rng(0)
+    series = [rng.normal(size = 200) for _ in range(3)]
+    recipe = [('exhaustive_shapelet', {'window_length' : 20, 'step' : 5, 'metric' : 'euclidean', 'verbose' : False})]
+
+    with ShapeletBatch(recipe, parallel_cores = 1, dtype = np.float32) as batch:
+        results = batch.run(series)
+
+    for key, values in enumerate(series):
+        shape = Shapelet(values, dtype = np.float32)
+        shape.exhaustive_shapelet(window_length = 20, step = 5, metric = 'euclidean', verbose = False)
+        assert results[key]['shapelet'].dtype == np.float32
+        assert np.array_equal(results[key]['shapelet'], shape.shapelet)
+
+
+def test_dba_barycenter_keeps_float32():
+    rng = np.random.default_rng(0)
+    C = [np.sin(np.linspace(0, 6, 50) + rng.uniform(-0.5, 0.5)) for _ in range(5)]
+    single = dba_barycenter([c.astype(np.float32) for c in C])
+    assert single.dtype == np.float32
+    assert dba_barycenter(C).dtype == np.float64
+    assert np.allclose(single, dba_barycenter(C), atol = 1e-5)
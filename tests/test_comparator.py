@@ -0,0 +1,96 @@
+import numpy as np
+from tsshapelet import metrics, pairwise_argmin
+
+
+def medoid_library(n, length = 32, seed = 0):
+    rng = np.random.default_rng(seed)
+    return np.sin(np.linspace(0, 6, length)) + rng.normal(scale = rng.uniform(0.05, 1, size = (n, 1)), size = (n, length))
+
+
+def medoid_means(C, metric = 'dtw', w = 0.9, exclusion = 0):
+    # The mean distance of each candidate to those outside its exclusion zone, one pair at a time
+    means = []
+    for i in range(len(C)):
+        others = [j for j in range(len(C)) if abs(i - j) > exclusion]
+        means.append(np.mean([metrics[metric](C[i], C[j], w) for j in others]))
+    return np.array(means)
+
+
+def medoid_reference(C, metric = 'dtw', w = 0.9, exclusion = 0):
+    return int(np.argmin(medoid_means(C, metric, w, exclusion)))
+
+
+def test_approximate_pairwise_argmin_small_library_runs_exact_search():
+    C = medoid_library(40)
+    index, stats = pairwise_argmin(C, metric = 'euclidean', w = 1, approximate = True, seed = 0, return_stats = True)
+    assert index == pairwise_argmin(C, metric = 'euclidean', w = 1)
+    assert stats['distance_calls'] <= 40 * 39 // 2
+
+
+def test_approximate_pairwise_argmin_computes_fewer_distances_than_exact():
+    n = 400
+    C = medoid_library(n)
+    index, stats = pairwise_argmin(C, metric = 'euclidean', w = 1, approximate = True, seed = 0, return_stats = True)
+    assert index == pairwise_argmin(C, metric = 'euclidean', w = 1)
+    assert stats['distance_calls'] < n * (n - 1) // 2
+
+
+def test_approximate_pairwise_argmin_matches_reference_dtw():
+    rng = np.random.default_rng(1)
+    C = [np.sin(np.linspace(0, 6, length)) + rng.uniform(0.05, 1) * rng.normal(size = length) for length in rng.integers(28, 36, size = 150)]
+    index, stats = pairwise_argmin(C, w = 0.5, approximate = True, seed = 0, return_stats = True)
+    assert index == medoid_reference(C, 'dtw', 0.5)
+    assert stats['distance_calls'] < 150 * 149 // 2
+
+
+def test_multiresolution_distance_calls_match_work(monkeypatch):
+    from tsshapelet import comparator
+    n, exclusion = 100, 5
+    C = medoid_library(n, length = 64)
+    calls = [0]
+    euclidean = comparator.batch_metrics['euclidean']
+
+    def counted(q, C, **kwargs):
+        calls[0] += len(C)
+        return euclidean(q, C, **kwargs)
+
+    monkeypatch.setitem(comparator.batch_metrics, 'euclidean', counted)
+    index, stats = pairwise_argmin(C, metric = 'euclidean', w = 1, levels = 3, exclusion = exclusion, return_stats = True)
+    assert stats['kept'] == [100, 10, 1]
+    assert stats['distance_calls'] == calls[0]
+    assert index == pairwise_argmin(C, metric = 'euclidean', w = 1, levels = 3, keep = 1, exclusion = exclusion)
+
+
+def test_multiresolution_pairwise_argmin_matches_reference():
+    C = medoid_library(120, length = 64)
+    for exclusion in (0, 3):
+        means = medoid_means(C, 'dtw', 0.2, exclusion)
+        assert pairwise_argmin(C, w = 0.2, levels = 3, keep = 1, exclusion = exclusion) == np.argmin(means)
+
+        # Pruning is a heuristic: the candidate found is near the medoid, though not always at it
+        index = pairwise_argmin(C, w = 0.2, levels = 3, keep = 0.2, exclusion = exclusion)
+        assert means[index] <= 1.05 * means.min()
+
+
+def test_multiresolution_infinite_distances():
+    rng = np.random.default_rng(0)
+    C = [np.sin(np.linspace(0, 6, length)) + 0.2 * rng.normal(size = length) for length in [64] * 40 + [60] * 10 + [68] * 10]
+    assert pairwise_argmin(C, w = 0.1, levels = 2, keep = 1, exclusion = 2) == pairwise_argmin(C, w = 0.1, exclusion = 2)
+
+
+def test_approximate_pairwise_argmin_infinite_distances():
+    # With a narrow band, DTW is infinite between the 60 and 68 long candidates, so only
+    # the 64 long ones have finite sums
+    rng = np.random.default_rng(0)
+    C = [np.sin(np.linspace(0, 6, length)) + 0.2 * rng.normal(size = length) for length in [64] * 150 + [60] * 30 + [68] * 30]
+    assert pairwise_argmin(C, w = 0.1, approximate = True, seed = 0) == pairwise_argmin(C, w = 0.1)
+
+    # Every sum infinite
+    C = C[:150] + [np.zeros(20)]
+    assert pairwise_argmin(C, w = 0.1, approximate = True, seed = 0) == pairwise_argmin(C, w = 0.1) == 0
+
+
+def test_pair_memo_is_bounded():
+    from tsshapelet.comparator import PairMemo
+    memo = PairMemo(100000, max_bytes = 1 << 20)
+    assert memo.values.nbytes <= 1 << 20
@@ -0,0 +1,22 @@
+import numpy as np
+from tsshapelet import Executor
+
+
+def test_executor_reloads_library_changed_in_place():
+    C = np.random.default_rng(0).normal(size = (20, 16))
+    q = C[7].copy()
+    with Executor(parallel_cores = 2) as executor:
+        assert executor.query(q, C, metric = 'euclidean', w = 1) == 7
+        library = executor.load(C)
+        assert executor.load(C) is library
+
+        C[3] = q
+        C[7] = -q
+        assert executor.load(C) is library
+        executor.load(C, reload = True)
+        assert executor.query(q, C, metric = 'euclidean', w = 1) == 3
+        assert np.allclose(executor.score(q, C, metric = 'euclidean', w = 1)[[3, 7]], [0, 2 * np.linalg.norm(q)])
+
+        executor.release()
+        C[3] = -q
+        assert executor.query(q, C, metric = 'euclidean', w = 1) != 3
@@ -0,0 +1,49 @@
+import numpy as np
+from tsshapelet import EnvelopeIndex, VPTree, dtw
+from tsshapelet.metrics import ed_batch
+
+
+def test_vptree_topk_matches_scan_and_prunes():
+    rng = np.random.default_rng(0)
+    C = np.cumsum(rng.normal(size = (4000, 32)), axis = 1)
+    tree = VPTree(C, leaf_size = 8, seed = 0)
+    q = C[123] + rng.normal(scale = 0.01, size = 32)
+
+    indices, distances, stats = tree.query_topk(q, k = 1, return_stats = True)
+    exact = ed_batch(q, C, tree.w)
+    assert indices[0] == np.argmin(exact)
+    assert np.isclose(distances[0], exact.min())
+    assert stats['distances'] < 0.02 * len(C)
+
+    indices, distances = tree.query_topk(q, k = 5)
+    assert np.allclose(distances, np.sort(exact)[:5])
+
+
+def test_envelope_index_topk_matches_scan():
+    rng = np.random.default_rng(0)
+    C = np.cumsum(rng.normal(size = (600, 32)), axis = 1)
+    index = EnvelopeIndex(C[:500], w = 0.1, bucket_size = 16, seed = 0)
+    index.add(C[500:])
+
+    for q in C[rng.integers(len(C), size = 5)] + rng.normal(scale = 0.5, size = (5, 32)):
+        exact = np.array([dtw(q, c, 0.1) for c in C])
+        indices, distances, stats = index.query_topk(q, k = 3, return_stats = True)
+        assert np.allclose(distances, np.sort(exact)[:3])
+        assert index.query(q) == np.argmin(exact)
+        assert stats['dtw'] < len(C)
+
+
+def test_vptree_after_add_and_reload_matches_scan(tmp_path):
+    rng = np.random.default_rng(1)
+    C = rng.normal(size = (300, 16))
+    tree = VPTree(C[:200], seed = 0)
+    tree.add(C[200:])
+    tree.save(tmp_path / 'tree.npz')
+    loaded = VPTree.load(tmp_path / 'tree.npz')
+
+    q = rng.normal(size = 16)
+    exact = ed_batch(q, C, tree.w)
+    for index in (tree, loaded):
+        indices, distances = index.query_topk(q, k = 4)
+        assert np.array_equal(indices, np.argsort(exact)[:4])
+        assert np.allclose(distances, np.sort(exact)[:4])
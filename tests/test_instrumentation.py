@@ -0,0 +1,29 @@
+import numpy as np
+from tsshapelet import add_hook, remove_hook, MetricsCollector, pairwise_argmin, score, shapelet_transform, get_distance_cache
+
+
+def collect(func):
+    get_distance_cache().clear()
+    collector = add_hook(MetricsCollector())
+    try:
+        func()
+    finally:
+        remove_hook(collector)
+    return collector.summary()
+
+
+def test_dtw_cells_from_every_path():
+    C = np.cumsum(np.random.default_rng(0).normal(size = (30, 24)), axis = 1)
+
+    listed = collect(lambda: pairwise_argmin(list(C), w = 0.5))
+    batched = collect(lambda: pairwise_argmin(C, w = 0.5))
+    threaded = collect(lambda: pairwise_argmin(C, w = 0.5, backend = 'thread', parallel_cores = 2))
+    assert listed['dtw_cells'] > 0
+    assert batched['dtw_cells'] == threaded['dtw_cells'] == listed['dtw_cells']
+    assert batched['dtw_cell_ratio'] == 1.0
+
+    scored = collect(lambda: score(C[0], C, w = 0.5, backend = 'thread'))
+    assert scored['dtw_cells'] == collect(lambda: score(C[0], list(C), w = 0.5))['dtw_cells']
+
+    transformed = collect(lambda: shapelet_transform([C[0][:8]], [C[1]], metric = 'dtw', w = 0.5))
+    assert transformed['dtw_cells'] > 0 and 0 < transformed['dtw_cell_ratio'] <= 1
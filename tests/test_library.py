@@ -0,0 +1,49 @@
+import pickle
+import numpy as np
+import pytest
+from tsshapelet import Executor, RaggedLibrary, pairwise_argmin, query, query_topk, score
+
+
+def ragged_series(n = 40, seed = 0):
+    rng = np.random.default_rng(seed)
+    return [np.cumsum(rng.normal(size = length)) for length in rng.integers(20, 30, size = n)]
+
+
+def test_ragged_library_round_trip(tmp_path):
+    C = ragged_series()
+    library = RaggedLibrary.write(tmp_path / 'library', C)
+
+    assert len(library) == len(C)
+    assert np.array_equal(library.lengths, [len(c) for c in C])
+    assert all(np.array_equal(a, b) for a, b in zip(library, C))
+    assert np.array_equal(library[-1], C[-1])
+    with pytest.raises(ValueError):
+        library[-1][0] = 0
+    with pytest.raises(IndexError):
+        library[len(C)]
+
+    part = pickle.loads(pickle.dumps(library[10:20]))
+    assert len(part) == 10
+    assert all(np.array_equal(a, b) for a, b in zip(part, C[10:20]))
+
+    single = RaggedLibrary.write(tmp_path / 'single', C, dtype = np.float32)
+    assert single[0].dtype == np.float32
+
+
+def test_ragged_library_search_matches_list(tmp_path):
+    C = ragged_series()
+    library = RaggedLibrary.write(tmp_path / 'library', C)
+    q = C[5][:20] + 0.01
+
+    assert query(q, library) == query(q, C)
+    assert np.allclose(score(q, library), score(q, C))
+    indices, distances = query_topk(q, library, k = 3)
+    expected, expected_distances = query_topk(q, C, k = 3)
+    assert np.array_equal(indices, expected) and np.allclose(distances, expected_distances)
+    assert pairwise_argmin(library) == pairwise_argmin(C)
+
+    with Executor(parallel_cores = 2) as executor:
+        assert executor.load(library) is library
+        assert query(q, library, executor = executor) == query(q, C)
+        assert np.allclose(score(q, library, executor = executor), score(q, C))
+        assert pairwise_argmin(library, executor = executor) == pairwise_argmin(C)
@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+from tsshapelet import metrics, pairwise_argmin, pairwise_distances, query, register_metric, score, get_distance_cache
+
+
+def manhattan(I, J, w = 1, r = np.inf):
+    return float(np.sum(np.abs(I - J)))
+
+
+def overshoot(I, J, w = 1, r = np.inf):
+    ''' Asymmetric: exceeding J costs twice as much as falling short of it. '''
+    return float(np.sum(np.maximum(I - J, 0)) * 2 + np.sum(np.maximum(J - I, 0)))
+
+
+def library(n = 25, length = 12, seed = 0):
+    return np.random.default_rng(seed).normal(size = (n, length))
+
+
+def test_registered_metric_matches_reference():
+    register_metric('test_manhattan', manhattan)
+    C = library()
+    reference = np.array([[manhattan(a, b) for b in C] for a in C])
+
+    assert np.allclose(score(C[0], C, metric = 'test_manhattan'), reference[0])
+    assert query(C[3] + 0.01, C, metric = 'test_manhattan') == 3
+    assert pairwise_argmin(C, metric = 'test_manhattan') == np.argmin(reference.sum(axis = 1))
+    assert np.allclose(pairwise_distances(C, metric = 'test_manhattan'), reference[np.triu_indices(len(C), 1)])
+
+
+def test_asymmetric_metric():
+    register_metric('test_overshoot', overshoot, symmetric = False)
+    get_distance_cache().clear()
+    C = library()
+    reference = np.array([[overshoot(a, b) for b in C] for a in C])
+    expected = int(np.argmin(reference.sum(axis = 1)))
+
+    assert metrics['test_overshoot'](C[0], C[1], w = 1) == reference[0, 1]
+    assert metrics['test_overshoot'](C[1], C[0], w = 1) == reference[1, 0]
+    assert pairwise_argmin(C, metric = 'test_overshoot') == expected
+    assert pairwise_argmin(list(C), metric = 'test_overshoot') == expected
+    assert pairwise_argmin(C, metric = 'test_overshoot', levels = 2, keep = 1) == expected
+    with pytest.raises(ValueError):
+        pairwise_distances(C, metric = 'test_overshoot')
+
+
+def test_asymmetric_metric_approximate():
+    register_metric('test_overshoot', overshoot, symmetric = False)
+    C = library(n = 150) + np.linspace(0, 3, 150)[:, None]
+    reference = np.array([[overshoot(a, b) for b in C] for a in C])
+    assert pairwise_argmin(C, metric = 'test_overshoot', approximate = True, seed = 0) == np.argmin(reference.sum(axis = 1))
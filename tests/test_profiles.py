@@ -0,0 +1,44 @@
+import numpy as np
+from tsshapelet import metrics, shapelet_transform, window_distance_sums
+
+
+def test_window_distance_sums_large_offset():
+    rng = np.random.default_rng(0)
+    series = 1e3 + 1e-3 * np.cumsum(rng.normal(size = 1000))
+    m, step = 50, 2
+    windows = np.lib.stride_tricks.sliding_window_view(series, m)[:len(range(0, len(series) - m, step)) * step:step]
+    direct = np.array([np.sqrt(((windows - window)**2).sum(axis = 1)).sum() for window in windows])
+
+    sums = window_distance_sums(series, m, step)
+    assert np.allclose(sums, direct, rtol = 1e-9)
+
+
+def test_window_distance_sums_exclusion_matches_direct():
+    rng = np.random.default_rng(1)
+    series = np.cumsum(rng.normal(size = 400))
+    m, step, exclusion = 30, 3, 4
+    windows = np.lib.stride_tricks.sliding_window_view(series, m)[:len(range(0, len(series) - m, step)) * step:step]
+    distances = np.sqrt(((windows[:, None] - windows[None])**2).sum(axis = 2))
+    positions = np.arange(len(windows))
+    distances[np.abs(positions[:, None] - positions[None]) <= exclusion] = 0
+
+    assert np.allclose(window_distance_sums(series, m, step, exclusion), distances.sum(axis = 1), rtol = 1e-9)
+
+
+def profile_min(S, T, metric, w):
+    m = len(S)
+    if m > len(T):
+        return np.inf
+    return min(metrics[metric](S, T[i:i+m], w) for i in range(len(T) - m + 1))
+
+
+def test_shapelet_transform_matches_sliding_scan():
+    rng = np.random.default_rng(2)
+    series_batch = [np.cumsum(rng.normal(size = length)) for length in (80, 120, 25, 100)]
+    shapelets = [series_batch[0][10:40], series_batch[1][50:70] + 0.1, rng.normal(size = 35)]
+
+    for metric, w in (('euclidean', 0.9), ('dtw', 0.2)):
+        expected = np.array([[profile_min(S, T, metric, w) for S in shapelets] for T in series_batch])
+        for parallel_cores in (1, 2):
+            features = shapelet_transform(shapelets, series_batch, metric = metric, w = w, parallel_cores = parallel_cores)
+            assert np.allclose(features, expected, rtol = 1e-9, atol = 1e-9)
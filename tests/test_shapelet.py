@@ -0,0 +1,13 @@
+import numpy as np
+from tsshapelet import Shapelet
+
+
+def test_exhaustive_shapelet_is_a_writable_copy():
+    series = np.sin(np.linspace(0, 20, 300))
+    shape = Shapelet(series)
+    shape.exhaustive_shapelet(window_length = 40, step = 5, metric = 'euclidean', verbose = False)
+
+    assert not shape.candidates.flags.writeable
+    assert shape.shapelet.flags.writeable
+    shape.shapelet -= 1
+    assert np.array_equal(shape.series, series)
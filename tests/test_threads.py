@@ -0,0 +1,43 @@
+import os, subprocess, sys, textwrap
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_script(tmp_path, source, **env):
+    # Run in a fresh interpreter: a pool forked after the tbb threading layer has run
+    # hangs at exit, which would otherwise hang the test session
+    script = tmp_path / 'script.py'
+    script.write_text(textwrap.dedent(source))
+    environ = {key : value for key, value in os.environ.items() if key != 'NUMBA_THREADING_LAYER'}
+    environ.update(env, PYTHONPATH = ROOT + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    return subprocess.run([sys.executable, str(script)], env = environ, timeout = 120, capture_output = True)
+
+
+def test_process_backend_after_thread_backend_unguarded(tmp_path):
+    result = run_script(tmp_path, '''
+        import numba, numpy as np
+        from tsshapelet import score
+
+        C = np.random.default_rng(0).normal(size = (40, 30))
+        threaded = score(C[0], C, parallel_cores = 2, backend = 'thread')
+        processed = score(C[0], C, parallel_cores = 2, backend = 'process')
+        assert np.allclose(threaded, processed)
+        assert numba.threading_layer() == 'workqueue'
+    ''')
+    assert result.returncode == 0, result.stderr.decode()
+
+
+def test_process_pool_after_tbb_raises(tmp_path):
+    result = run_script(tmp_path, '''
+        import numpy as np
+        from tsshapelet import score
+
+        C = np.random.default_rng(0).normal(size = (40, 30))
+        score(C[0], C, parallel_cores = 2, backend = 'thread')
+        score(C[0], C, parallel_cores = 2, backend = 'process')
+    ''', NUMBA_THREADING_LAYER = 'tbb')
+    stderr = result.stderr.decode()
+    if 'No threading layer could be loaded' in stderr:
+        pytest.skip('tbb is not installed')
+    assert result.returncode != 0 and 'RuntimeError' in stderr
@@ -1,6 +1,18 @@
+__version__ = '2.2.2'
+
 from .shapelet import Shapelet
+from .streaming import StreamingShapelet
+from .batch import ShapeletBatch
 from .utils import utils
 from .barycenters import barycenters
-from .metrics import metrics, dtw, dtw_matrix
-from .features import statistical_features, time_series_features
-from .comparator import query, pairwise_argmin, score
\ No newline at end of file
+from .cache import DistanceCache
+from .metrics import metrics, dtw, dtw_matrix, dtw_distance, dtw_path, set_distance_cache, get_distance_cache, register_metric
+from .features import statistical_features, time_series_features, batch_statistical_features
+from .comparator import query, query_topk, pairwise_argmin, pairwise_distances, score
+from .executor import Executor
+from .aio import AsyncExecutor
+from .library import RaggedLibrary
+from .index import VPTree, EnvelopeIndex
+from .instrumentation import add_hook, remove_hook, MetricsCollector
+from .profiles import window_distance_sums, shapelet_transform
+from .jit import warmup
\ No newline at end of file
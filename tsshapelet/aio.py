@@ -0,0 +1,168 @@
+from .executor import Executor
+from .comparator import emit_query_stats, query_stats
+from concurrent.futures import ThreadPoolExecutor
+import asyncio, numpy as np
+
+# --------------------------------------------------------------------------------
+# Asyncio executor
+# --------------------------------------------------------------------------------
+
+class AsyncExecutor:
+
+    ''' Awaitable `query`, `query_topk` and `score` for use from an asyncio event loop,
+        running on a persistent `Executor`.
+
+        Requests made within `batch_delay` seconds of each other against the same library
+        object, with the same parameters, are grouped into a single pass over the library,
+        in which each worker searches one chunk for all of the queries. Calls are sent to
+        the worker pool from a background thread, so the event loop is never blocked.
+
+        A request may be cancelled or time out while it waits or runs: its result is then
+        discarded, although a search already running on the workers is completed.
+
+        Examples:
+            >>> async with AsyncExecutor(parallel_cores = 4) as executor:
+            ...     index = await executor.query(q, C, timeout = 1.0)
+            ...     indices, distances = await executor.query_topk(q, C, k = 5)'''
+
+    def __init__(self, parallel_cores = None, executor = None, batch_delay = 0.001, max_batch = 64):
+        '''
+        Parameters:
+            parallel_cores (int, optional): The number of worker processes, if no executor is given.
+                Defaults to None, all cores.
+            executor (Executor, optional): An existing Executor to run on. It is not closed by `close`.
+                Defaults to None, a new Executor.
+            batch_delay (float, optional): How long, in seconds, the first request of a batch waits for
+                others to join it. Defaults to 0.001.
+            max_batch (int, optional): The maximum number of queries in a batch. A full batch is run
+                immediately. Defaults to 64.
+        '''
+        self.owned = executor is None
+        self.executor = Executor(parallel_cores) if executor is None else executor
+        self.batch_delay = batch_delay
+        self.max_batch = max_batch
+
+        # A single thread talks to the pool, so that libraries are loaded one at a time
+        self.thread = ThreadPoolExecutor(max_workers = 1)
+        self.pending = {}
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        ''' Waits for the running batches, then shuts the thread and, if it owns it, the Executor down. '''
+        for key in list(self.pending):
+            self.dispatch(key)
+        await asyncio.get_running_loop().run_in_executor(None, self.thread.shutdown)
+        if self.owned:
+            self.executor.close()
+
+    # --------------------------------------------------------------------------------
+    # Requests
+    # --------------------------------------------------------------------------------
+
+    async def query(self, q, C, w = 0.9, metric = 'dtw', timeout = None):
+        '''
+        Awaitable `query`: the index of the time series in C closest to q, or None if C is empty.
+
+        Raises:
+            TimeoutError: If no result is available after `timeout` seconds.
+        '''
+        indices, _ = await self.query_topk(q, C, 1, w, metric, timeout)
+        return int(indices[0]) if len(indices) else None
+
+    async def query_topk(self, q, C, k = 10, w = 0.9, metric = 'dtw', timeout = None):
+        '''
+        Awaitable `query_topk`: the indices of the k nearest time series in C and their distances to q.
+
+        Raises:
+            ValueError: If `k` is not a positive integer.
+            TimeoutError: If no result is available after `timeout` seconds.
+        '''
+        if type(k) != int or k < 1:
+            raise ValueError('k must be a positive integer.')
+
+        best = await self.submit(('topk', k, w, metric), q, C, timeout)
+        indices = np.array([i for _, i in best], dtype = int)
+        distances = np.array([dist for dist, _ in best], dtype = float)
+        return indices, distances
+
+    async def score(self, q, C, metric = 'dtw', w = 0.9, timeout = None):
+        '''
+        Awaitable `score`: the distances from q to every time series in C.
+
+        Raises:
+            TimeoutError: If no result is available after `timeout` seconds.
+        '''
+        return await self.submit(('score', metric, w), q, C, timeout)
+
+    # --------------------------------------------------------------------------------
+    # Batching
+    # --------------------------------------------------------------------------------
+
+    async def submit(self, params, q, C, timeout = None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        key = (id(C),) + params
+        if key not in self.pending:
+            timer = loop.call_later(self.batch_delay, self.dispatch, key)
+            self.pending[key] = (C, [], timer)
+
+        requests = self.pending[key][1]
+        requests.append((np.asarray(q), future))
+        if len(requests) >= self.max_batch:
+            self.dispatch(key)
+
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f'The request did not complete within {timeout} seconds.') from None
+
+    def dispatch(self, key):
+        '''
+        Sends the pending batch for key to the worker thread, dropping requests that were cancelled.
+        '''
+        if key not in self.pending:
+            return
+        C, requests, timer = self.pending.pop(key)
+        timer.cancel()
+
+        requests = [(q, future) for q, future in requests if not future.done()]
+        if not requests:
+            return
+
+        queries = [q for q, _ in requests]
+        job = asyncio.get_running_loop().run_in_executor(self.thread, self.run, key[1:], queries, C)
+        job.add_done_callback(lambda job: self.resolve(job, requests))
+
+    def run(self, params, queries, C):
+        if params[0] == 'score':
+            _, metric, w = params
+            return list(self.executor.score_many(queries, C, metric, w))
+
+        _, k, w, metric = params
+        stats = [query_stats(len(C)) for _ in queries]
+        results = self.executor.query_topk_many(queries, C, k, w, metric, stats)
+        for counters in stats:
+            emit_query_stats(counters, metric, k)
+        return results
+
+    @staticmethod
+    def resolve(job, requests):
+        if job.cancelled():
+            for _, future in requests:
+                future.cancel()
+            return
+
+        error = job.exception()
+        for i, (_, future) in enumerate(requests):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(job.result()[i])
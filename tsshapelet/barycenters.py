@@ -1,4 +1,7 @@
-from .utils import utils, np
+from .utils import utils, np, float_dtype
+from .metrics import dtw_path
+from .comparator import find_pool_size, chunk_bounds, process_pool
+from .jit import njit
 
 #-------------------------------------------
 # Helper methods for barycenter computation 
@@ -12,15 +15,88 @@ def interpolated_average_barycenter(C):
         C (array-like, shape = (n_instances, length)): The set of time sequences for the barycenter computation.
 
     Returns:
-        interpolated_average_barycenter: np.array, shape = (length, )
+        interpolated_average_barycenter: np.array, shape = (length, ), float32 if every series is float32.
     '''
+    dtype = float_dtype(C)
     length = np.mean(list(map(len, C)), dtype = int)
     C = np.array([utils['interpolate'](c, length) for c in C])
-    return np.mean(C, axis = 0)
+    return np.mean(C, axis = 0).astype(dtype, copy = False)
 
 def average_barycenter(C):
     return np.mean(C, axis = 0)
 
+@njit
+def dba_sums(average, values, offsets, w = 0.9):
+    '''
+    Aligns each series to the average with DTW, and accumulates the values aligned to each
+    index of the average.
+    '''
+    sums, counts = np.zeros(len(average)), np.zeros(len(average))
+    for k in range(len(offsets) - 1):
+        series = values[offsets[k]:offsets[k+1]]
+        path = dtw_path(average, series, w)
+        for p in range(len(path)):
+            sums[path[p, 0]] += series[path[p, 1]]
+            counts[path[p, 0]] += 1
+    return sums, counts
+
+def dba_worker(args):
+    average, C, w = args
+    return dba_sums(average, *utils['pack'](C), w)
+
+def dba_barycenter(C, w = 0.9, max_iter = 10, tol = 1e-5, parallel_cores = 1):
+    '''
+    Computes the DTW Barycenter Average (DBA) of a collection of time series.
+
+    Starting from the interpolated average barycenter, each iteration aligns every series to the
+    current average with windowed DTW, and replaces each point of the average with the mean of the
+    values aligned to it. Unlike the interpolated average, this keeps phase-shifted features sharp.
+
+    Parameters:
+        C (array-like, shape = (n_instances, length)): The set of time sequences for the barycenter computation.
+        w (float, optional): Window constraint for the DTW alignment. Defaults to 0.9.
+        max_iter (int, optional): The maximum number of iterations. Defaults to 10.
+        tol (float, optional): Stops once an iteration changes the average by less than this fraction
+            of its norm. Defaults to 1e-5.
+        parallel_cores (int, optional): The number of cores to spread the alignments across. Defaults to 1.
+
+    Returns:
+        dba_barycenter: np.array, shape = (length, ), float32 if every series is float32. The
+        alignments are accumulated in float64 either way.
+    '''
+    dtype = float_dtype(C)
+    average = interpolated_average_barycenter(C).astype(np.float64)
+
+    if parallel_cores > 1:
+        pool_size = find_pool_size(parallel_cores)
+        chunks = [C[start:stop] for start, stop in chunk_bounds(len(C), pool_size)]
+        pool = process_pool(pool_size)
+    else:
+        values, offsets = utils['pack'](C)
+
+    try:
+        for _ in range(max_iter):
+
+            if parallel_cores > 1:
+                results = pool.map(dba_worker, [(average, chunk, w) for chunk in chunks])
+                sums, counts = sum(r[0] for r in results), sum(r[1] for r in results)
+            else:
+                sums, counts = dba_sums(average, values, offsets, w)
+
+            updated = np.where(counts > 0, sums / np.maximum(counts, 1), average)
+            change = np.linalg.norm(updated - average) / max(np.linalg.norm(average), np.finfo(float).eps)
+            average = updated
+
+            if change < tol:
+                break
+    finally:
+        if parallel_cores > 1:
+            pool.close()
+            pool.join()
+
+    return average.astype(dtype, copy = False)
+
 barycenters = {'interpolated' : interpolated_average_barycenter,
-               'average' : average_barycenter
+               'average' : average_barycenter,
+               'dba' : dba_barycenter
                }
\ No newline at end of file
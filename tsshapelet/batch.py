@@ -0,0 +1,143 @@
+from .shapelet import Shapelet
+from .comparator import find_pool_size, process_pool
+from collections.abc import Mapping
+import os, queue
+
+# --------------------------------------------------------------------------------
+# Recipes
+# --------------------------------------------------------------------------------
+
+def parse_recipe(recipe):
+    '''
+    Normalizes a recipe into a tuple of (method, kwargs) steps, checking that every
+    method exists on Shapelet. A step may be given as a bare method name.
+    '''
+    steps = []
+    for step in recipe:
+        method, kwargs = (step, {}) if isinstance(step, str) else step
+        if not callable(getattr(Shapelet, method, None)):
+            raise ValueError(f'Shapelet has no method {method!r}.')
+        steps.append((method, dict(kwargs)))
+    return tuple(steps)
+
+
+def process_series(key, series, recipe, attributes, dtype = None):
+    '''
+    Runs a recipe on one series, returning the key and the requested attributes of the
+    Shapelet, so that the series and its candidates are not sent back to the parent.
+    '''
+    shape = Shapelet(series, dtype = dtype)
+    for method, kwargs in recipe:
+        getattr(shape, method)(**kwargs)
+    return key, {attribute : getattr(shape, attribute) for attribute in attributes}
+
+
+# --------------------------------------------------------------------------------
+# ShapeletBatch
+# --------------------------------------------------------------------------------
+
+class ShapeletBatch:
+
+    ''' Runs the same Shapelet recipe over many independent series, spreading whole
+        series across one long-lived process pool rather than parallelizing inside
+        each series.
+
+        A recipe is a sequence of (method, kwargs) steps called on a Shapelet of each
+        series, preprocessing first and extraction last. Series are submitted lazily,
+        with at most `max_pending` in flight, and results are yielded as they complete,
+        so memory stays bounded however many series are passed.
+
+        Examples:
+            >>> recipe = [('z_normalization', {}),
+            ...           ('exhaustive_shapelet', {'window_length' : 100, 'step' : 5, 'verbose' : False})]
+            >>> with ShapeletBatch(recipe, parallel_cores = 8) as batch:
+            ...     for channel, result in batch.map(channels):
+            ...         save(channel, result['shapelet'])'''
+
+    def __init__(self, recipe, parallel_cores = None, max_pending = None, attributes = ('shapelet',), dtype = None):
+        '''
+        Parameters:
+            recipe (Sequence[tuple[str, dict]]): The Shapelet methods to call on each series, in order,
+                with their keyword arguments. A step may also be a bare method name.
+            parallel_cores (int, optional): The number of worker processes. If 1, series are processed in
+                this process. Defaults to None, all cores.
+            max_pending (int, optional): The maximum number of series submitted but not yet yielded.
+                Defaults to twice the number of processes.
+            attributes (Sequence[str], optional): The Shapelet attributes returned for each series.
+                Defaults to ('shapelet',).
+            dtype (np.dtype, optional): The dtype of each Shapelet, as in `Shapelet(series, dtype = ...)`:
+                np.float32 halves the memory of the series and their candidates. Defaults to None.
+
+        Raises:
+            ValueError: If a step of the recipe is not a Shapelet method.
+
+        Note:
+            Every step runs inside a worker process, so the steps themselves must not start a pool:
+            leave their `parallel_cores` at 1 and pass no `executor`.
+        '''
+        self.recipe = parse_recipe(recipe)
+        self.attributes = tuple(attributes)
+        self.dtype = dtype
+        self.processes = find_pool_size(parallel_cores or os.cpu_count())
+        self.max_pending = max_pending or 2 * self.processes
+        self.pool = process_pool(self.processes) if self.processes > 1 else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        ''' Shuts the workers down. '''
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def map(self, series):
+        '''
+        Runs the recipe on every series.
+
+        Parameters:
+            series (Iterable[Sequence[float]] or Mapping): The series to process. A mapping is
+                processed by key; any other iterable by position, and may be a generator.
+
+        Yields:
+            tuple: (key, result), in order of completion, where key is the key or position of the
+            series and result a dict of the requested attributes.
+        '''
+        items = iter(series.items()) if isinstance(series, Mapping) else enumerate(series)
+
+        if self.pool is None:
+            for key, values in items:
+                yield process_series(key, values, self.recipe, self.attributes, self.dtype)
+            return
+
+        # Workers put their results on a queue from the pool's result thread
+        results = queue.SimpleQueue()
+        pending = 0
+
+        for key, values in items:
+            self.pool.apply_async(process_series, (key, values, self.recipe, self.attributes, self.dtype),
+                                  callback = results.put, error_callback = results.put)
+            pending += 1
+            while pending >= self.max_pending:
+                pending -= 1
+                yield self.result(results.get())
+
+        while pending:
+            pending -= 1
+            yield self.result(results.get())
+
+    def run(self, series):
+        '''
+        Runs the recipe on every series, returning a dict of results by key.
+        '''
+        return dict(self.map(series))
+
+    @staticmethod
+    def result(item):
+        if isinstance(item, BaseException):
+            raise item
+        return item
@@ -0,0 +1,91 @@
+import hashlib, sys, numpy as np
+from collections import OrderedDict
+
+# --------------------------------------------------------------------------------
+# Byte-bounded distance cache
+# --------------------------------------------------------------------------------
+
+class DistanceCache:
+
+    ''' A least-recently-used cache of exact distances between pairs of arrays, bounded
+        by an approximate byte budget. Entries are keyed on a hash of the array buffers,
+        the metric and the window constraint w. The early abandon radius is not part of
+        the key: only exact distances are stored.
+
+        Any object providing the same `enabled`, `key`, `get` and `put` members can be
+        installed in place of this one with `metrics.set_distance_cache`.'''
+
+    # Rough size of the OrderedDict node holding each entry
+    node_bytes = 104
+
+    def __init__(self, max_bytes = 2**27, enabled = True):
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def digest(I):
+        ''' Hashes the dtype, shape and buffer of an array. '''
+        I = np.ascontiguousarray(I)
+        h = hashlib.blake2b(I.dtype.str.encode(), digest_size = 16)
+        h.update(np.int64(I.size).tobytes())
+        h.update(I.view(np.uint8))
+        return h.digest()
+
+    def key(self, metric, I, J, w, symmetric = True):
+        '''
+        Builds the key for the distance between I and J. For a symmetric metric, (I, J)
+        and (J, I) share an entry.
+        '''
+        a, b = self.digest(I), self.digest(J)
+        return (metric, w) + ((a, b) if a <= b or not symmetric else (b, a))
+
+    def entry_bytes(self, key, value):
+        return self.node_bytes + sys.getsizeof(key) + sum(map(sys.getsizeof, key)) + sys.getsizeof(value)
+
+    def get(self, key):
+        ''' Returns the cached distance, or None on a miss. '''
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        ''' Stores an exact distance, evicting the least recently used entries over budget. '''
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return
+        self.entries[key] = value
+        self.bytes += self.entry_bytes(key, value)
+        while self.bytes > self.max_bytes and self.entries:
+            old_key, old_value = self.entries.popitem(last = False)
+            self.bytes -= self.entry_bytes(old_key, old_value)
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        '''
+        Returns:
+            dict: hits, misses, hit rate, number of entries, and the used and maximum bytes.
+        '''
+        lookups = self.hits + self.misses
+        return {'hits' : self.hits,
+                'misses' : self.misses,
+                'hit_rate' : self.hits / lookups if lookups else 0.0,
+                'entries' : len(self.entries),
+                'bytes' : self.bytes,
+                'max_bytes' : self.max_bytes
+                }
@@ -1,5 +1,9 @@
-from .metrics import metrics
-import multiprocessing, os, numpy as np
+from . import instrumentation
+from .utils import as_float, paa
+from .jit import check_fork
+from .threads import thread_query, thread_score, thread_row_sums
+from .metrics import metrics, batch_metrics, is_batch, is_symmetric, envelope, lb_kim, lb_keogh, lb_kim_rows, lb_keogh_rows
+import heapq, multiprocessing, os, numpy as np
 
 # --------------------------------------------------------------------------------
 # Helpers
@@ -17,6 +21,7 @@ def find_pool_size(parallel_cores):
         pool_size int: the corrected number of CPU core to implement.
     '''
     maximum = os.cpu_count()
+    requested = parallel_cores
 
     if parallel_cores > maximum:
         parallel_cores = max(1, maximum - 1)
@@ -26,54 +31,147 @@ def find_pool_size(parallel_cores):
         parallel_cores = 1
         print(f'Parallel cores must be positive integer. Using 1 CPU core.')
 
+    if instrumentation.hooks:
+        instrumentation.emit('pool_size', parallel_cores, requested = requested)
+
     return parallel_cores
 
 
+def process_pool(processes):
+    '''
+    A multiprocessing pool of the given size, checking first that its workers can be forked safely.
+    '''
+    check_fork()
+    return multiprocessing.Pool(processes = processes)
+
+
+def emit_query_stats(stats, metric, k):
+    if instrumentation.hooks:
+        for key, value in stats.items():
+            instrumentation.emit(f'query_{key}', value, metric = metric, k = k)
+
+
 # --------------------------------------------------------------------------------
 # query()
 # --------------------------------------------------------------------------------
 
-def query_worker(args):
-    
-    q, c, w, metric = args
-    return metrics[metric](q, c, w)
+def parallel_query(*args):
 
+    q, C, w, parallel_cores, metric = args[:5]
+    stats = args[5] if len(args) > 5 else query_stats()
+    best = parallel_query_topk(q, C, 1, w, metric, parallel_cores, stats)
+    return best[0][1] if best else None
 
-def parallel_query(*args):
 
-    q, C, w, parallel_cores, metric = args
+def check_backend(backend):
+    if backend not in ('process', 'thread'):
+        raise ValueError("backend must be 'process' or 'thread'.")
+
+
+def query_stats(n = 0):
+    '''
+    Counters reported by query(). Each lower bound counts the candidates it pruned, 
+    'dtw' counts the full distance computations and 'abandoned' the full computations
+    that were abandoned early.
+    '''
+    return {'candidates' : n, 'lb_kim' : 0, 'lb_keogh' : 0, 'lb_keogh_reversed' : 0, 'dtw' : 0, 'abandoned' : 0}
+
 
-    with multiprocessing.Pool(processes = find_pool_size(parallel_cores)) as pool:
-        results = pool.map(query_worker, [(q, c, w, metric) for c in C])
+def lower_bound_prunes(q, U, L, c, w, r, bounds = None):
+    '''
+    Runs the lower bound cascade for DTW, from the cheapest bound to the tightest.
+    `bounds` optionally holds the (LB_Kim, LB_Keogh) values precomputed for a batch.
 
-    best_so_far = np.inf
-    best_index = None
-    for i, dist in enumerate(results):
-        if dist < best_so_far:
-            best_so_far = dist
-            best_index = i
+    Returns:
+        str or None: The name of the bound that pruned the candidate, or None if the
+        full distance must be computed.
+    '''
+    if (lb_kim(q, c) if bounds is None else bounds[0]) >= r:
+        return 'lb_kim'
 
-    return best_index
+    if len(c) == len(q):
 
+        if (lb_keogh(U, L, c, r) if bounds is None else bounds[1]) >= r:
+            return 'lb_keogh'
+        
+        c_upper, c_lower = envelope(c, w)
+        if lb_keogh(c_upper, c_lower, q, r) >= r:
+            return 'lb_keogh_reversed'
+        
+    return None
 
-def sequential_query(*args):
 
-    q, C, w, metric = args
-    best_so_far = np.inf
-    best_index = None
+def nearest_k(q, C, k = 1, w = 0.9, metric = 'dtw', stats = None):
+    '''
+    Sequential k nearest neighbour search. A bounded heap holds the k best candidates so 
+    far, and the distance of the k-th best is the radius for early abandoning and, for 
+    'dtw', for the lower bound cascade.
+
+    Returns:
+        list[(float, int)]: Up to k (distance, index) pairs, sorted by distance.
+    '''
+    stats = query_stats() if stats is None else stats
+    heap = [] # (-distance, -index), so that the root is the worst of the k best
+    radius = np.inf
+
+    cascade = metric == 'dtw'
+    if cascade:
+        q = as_float(q)
+        U, L = envelope(q, w)
+
+        # The bounds of a 2-D batch of candidates are computed in a single pass
+        batch = is_batch(C) and C.shape[1] == len(q)
+        if batch:
+            C = as_float(C)
+            kim, keogh = lb_kim_rows(q, C), lb_keogh_rows(U, L, C)
 
     for i in range(len(C)):
 
-        dist = metrics[metric](q, C[i], w = w, r = best_so_far)
+        if cascade and len(heap) == k:
+            c = as_float(C[i])
+            pruned_by = lower_bound_prunes(q, U, L, c, w, radius, (kim[i], keogh[i]) if batch else None)
+            if pruned_by is not None:
+                stats[pruned_by] += 1
+                continue
+
+        dist = metrics[metric](q, C[i], w = w, r = radius)
+        stats['dtw'] += 1
 
-        if dist < best_so_far:
-            best_so_far = dist
-            best_index = i
+        if dist == np.inf:
+            stats['abandoned'] += 1
 
-    return best_index
+        elif len(heap) < k:
+            heapq.heappush(heap, (-dist, -i))
 
+        elif dist < radius:
+            heapq.heapreplace(heap, (-dist, -i))
 
-def query(q, C, w = 0.9, metric = 'dtw', parallel_cores = 1):
+        if len(heap) == k:
+            radius = -heap[0][0]
+
+    return sorted((-d, -i) for d, i in heap)
+
+
+def nearest(q, C, w = 0.9, metric = 'dtw', stats = None):
+    '''
+    Sequential nearest neighbour search with early abandoning and, for 'dtw', the
+    lower bound cascade.
+
+    Returns:
+        (int, float): The index of the nearest time series in C and its distance to q.
+    '''
+    best = nearest_k(q, C, 1, w, metric, stats)
+    return (best[0][1], best[0][0]) if best else (None, np.inf)
+
+
+def sequential_query(*args):
+
+    q, C, w, metric = args[:4]
+    stats = args[4] if len(args) > 4 else None
+    return nearest(q, C, w, metric, stats)[0]
+
+
+def query(q, C, w = 0.9, metric = 'dtw', parallel_cores = 1, return_stats = False, executor = None, backend = 'process'):
     '''
     Queries a time series database for the closest match to a query time series, using either a dynamic time warping (dtw) or Euclidean distance metric. The search can be performed either sequentially or in parallel, depending on the number of cores specified.
 
@@ -81,11 +179,19 @@ def query(q, C, w = 0.9, metric = 'dtw', parallel_cores = 1):
         q (Sequence[float]): Time series to query, shape = (q_length,).
         C (Sequence[Sequence[float]]): Library of time series, shape = (n_instances, length).
         w (int or float, optional): Window constraint for the distance functions. Defaults to 0.9.
-        metric (str, optional): Distance metric for comparison, either 'dtw' or 'euclidean'. Defaults to 'dtw'.
+        metric (str, optional): Distance metric for comparison: 'dtw', 'euclidean', 'z_euclidean' or a registered metric. Defaults to 'dtw'.
         parallel_cores (int, optional): Number of cores to use for parallel processing. Defaults to 1. If 1, a sequential procedure is implemented.
+        return_stats (bool, optional): If True, also returns the pruning counters of the search. Defaults to False.
+        executor (Executor, optional): A persistent worker pool. If given, the search runs on its workers
+            and `parallel_cores` is ignored. Defaults to None.
+        backend (str, optional): 'process' to parallelize with a multiprocessing pool, or 'thread' to run
+            compiled kernels on `parallel_cores` threads sharing the library, see the Note. Defaults to 'process'.
     
     Returns:
         int: The index of the time series in C that is closest to the query time series q.
+        dict: Only if `return_stats` is True. The number of candidates pruned by each lower bound
+            ('lb_kim', 'lb_keogh', 'lb_keogh_reversed'), the number of full distance computations ('dtw')
+            and how many of those were abandoned early ('abandoned').
     
     Raises:
         ValueError: If `metric` is not 'dtw' or 'euclidean'.
@@ -98,23 +204,160 @@ def query(q, C, w = 0.9, metric = 'dtw', parallel_cores = 1):
         1
 
     Note:
-        The sequential query utilizes the early abandon condition of dtw. Because of the overhead
-        of the multiprocessing, and the efficacy of the early abandon condition, the parallel query
+        The sequential query utilizes the early abandon condition of dtw. The parallel query splits
+        the library into chunks, each searched sequentially by a worker, so the early abandon condition
+        only applies within a chunk. Because of the overhead of the multiprocessing, the parallel query
         is only more efficient for very large searches, or potentially in worst-case scenarios, where
         the early abandon condition is scarcely met. 
+
+        With the 'dtw' metric, the sequential query runs a cascade of lower bounds before the full
+        distance: LB_Kim, then LB_Keogh on the envelope of the query (computed once per query), then
+        LB_Keogh on the envelope of the candidate. The LB_Keogh bounds apply to candidates of the same
+        length as the query.
+
+        The 'thread' backend packs the library into one contiguous buffer and searches it with numba
+        kernels that release the GIL, on up to NUMBA_NUM_THREADS threads. Nothing is pickled and no
+        process is started, so it also pays off for small and medium libraries. As with the process
+        pool, each thread searches a chunk with its own early abandon radius. It bypasses the
+        distance cache.
     '''
-    if parallel_cores > 1:
-        return parallel_query(q, C, w, parallel_cores, metric)
+    check_backend(backend)
+    stats = query_stats(len(C))
+
+    if executor is not None:
+        index = executor.query(q, C, w, metric, stats)
+
+    elif backend == 'thread':
+        index = thread_query(q, C, w, metric, parallel_cores, stats)
+
+    elif parallel_cores > 1:
+        index = parallel_query(q, C, w, parallel_cores, metric, stats)
     
     else:
-        return sequential_query(q, C, w, metric)
+        index = sequential_query(q, C, w, metric, stats)
+
+    emit_query_stats(stats, metric, 1)
+
+    if return_stats:
+        return index, stats
+    
+    return index
     
 
+# --------------------------------------------------------------------------------
+# query_topk()
+# --------------------------------------------------------------------------------
+
+def chunk_bounds(n, processes):
+    '''
+    Splits range(n) into a few (start, stop) chunks per process for load balancing.
+    '''
+    size = max(1, -(-n // (4 * processes)))
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+
+def merge_topk(k, *results):
+    '''
+    Merges sorted lists of (distance, index) pairs into the k best.
+    '''
+    return heapq.nsmallest(k, heapq.merge(*results))
+
+
+def topk_worker(args):
+    q, C, start, k, w, metric = args
+    stats = query_stats(len(C))
+    best = nearest_k(q, C, k, w, metric, stats)
+    return [(dist, start + i) for dist, i in best], stats
+
+
+def add_stats(stats, other):
+    for key in other:
+        if key != 'candidates':
+            stats[key] += other[key]
+
+
+def parallel_query_topk(q, C, k = 1, w = 0.9, metric = 'dtw', parallel_cores = 1, stats = None):
+
+    pool_size = find_pool_size(parallel_cores)
+    tasks = [(q, C[start:stop], start, k, w, metric) for start, stop in chunk_bounds(len(C), pool_size)]
+
+    with process_pool(pool_size) as pool:
+        results = pool.map(topk_worker, tasks)
+
+    for _, chunk_stats in results:
+        add_stats(stats, chunk_stats)
+
+    return merge_topk(k, *[best for best, _ in results])
+
+
+def query_topk(q, C, k = 10, w = 0.9, metric = 'dtw', parallel_cores = 1, return_stats = False, executor = None):
+    '''
+    Queries a time series database for the k closest matches to a query time series. 
+
+    A bounded heap holds the k best matches found so far, and the distance of the k-th best is 
+    used as the early abandon radius for the distance functions and, with 'dtw', for the lower 
+    bound cascade of `query`. In parallel, each worker searches a chunk of the library with its 
+    own heap, and the partial results are merged.
+
+    Parameters:
+        q (Sequence[float]): Time series to query, shape = (q_length,).
+        C (Sequence[Sequence[float]]): Library of time series, shape = (n_instances, length).
+        k (int, optional): The number of nearest neighbours to return. Defaults to 10.
+        w (int or float, optional): Window constraint for the distance functions. Defaults to 0.9.
+        metric (str, optional): Distance metric for comparison: 'dtw', 'euclidean', 'z_euclidean' or a registered metric. Defaults to 'dtw'.
+        parallel_cores (int, optional): Number of cores to use for parallel processing. Defaults to 1. If 1, a sequential procedure is implemented.
+        return_stats (bool, optional): If True, also returns the pruning counters of the search. Defaults to False.
+        executor (Executor, optional): A persistent worker pool. If given, the search runs on its workers
+            and `parallel_cores` is ignored. Defaults to None.
+
+    Returns:
+        np.ndarray: The indices of the k nearest time series in C, sorted by distance, shape = (k,).
+        np.ndarray: Their distances to q, shape = (k,).
+        dict: Only if `return_stats` is True. The same counters as `query`.
+
+    Raises:
+        ValueError: If `k` is not a positive integer.
+
+    Examples:
+        >>> q = [1, 2, 3]
+        >>> C = [[1, 2, 3], [4, 5, 6], [7, 8, 9], [1, 2, 4]]
+        >>> query_topk(q, C, k=2, w=1, metric='euclidean')
+        (array([0, 3]), array([0., 1.]))
+    '''
+    if type(k) != int or k < 1:
+        raise ValueError('k must be a positive integer.')
+
+    stats = query_stats(len(C))
+
+    if executor is not None:
+        best = executor.query_topk(q, C, k, w, metric, stats)
+
+    elif parallel_cores > 1:
+        best = parallel_query_topk(q, C, k, w, metric, parallel_cores, stats)
+
+    else:
+        best = nearest_k(q, C, k, w, metric, stats)
+
+    emit_query_stats(stats, metric, k)
+
+    indices = np.array([i for _, i in best], dtype = int)
+    distances = np.array([dist for dist, _ in best], dtype = float)
+
+    if return_stats:
+        return indices, distances, stats
+
+    return indices, distances
+
+
 # --------------------------------------------------------------------------------
 # score()
 # --------------------------------------------------------------------------------
     
 def sequential_score(q, C, metric = 'dtw', w = 0.9):
+
+    if is_batch(C):
+        return batch_metrics[metric](q, C, w = w)
+
     scores = []
     for c in C:
         scores.append(metrics[metric](q, c, w = w))
@@ -122,19 +365,22 @@ def sequential_score(q, C, metric = 'dtw', w = 0.9):
 
 
 def score_worker(args):
-    q, c, metric, w = args
-    return metrics[metric](q, c , w = w)
+    q, C, metric, w = args
+    return sequential_score(q, C, metric, w)
 
 
 def parallel_score(q, C, metric = 'dtw', w = 0.9, parallel_cores = 1):
 
-    with multiprocessing.Pool(processes=find_pool_size(parallel_cores)) as pool:
-        results = pool.map(score_worker, [(q, c, metric, w) for c in C])
+    pool_size = find_pool_size(parallel_cores)
+    tasks = [(q, C[start:stop], metric, w) for start, stop in chunk_bounds(len(C), pool_size)]
+
+    with process_pool(pool_size) as pool:
+        results = pool.map(score_worker, tasks)
 
-    return np.array(results)
+    return np.concatenate(results) if results else np.array([])
 
 
-def score(q, C, metric = 'dtw', w = 0.9, parallel_cores = 1):
+def score(q, C, metric = 'dtw', w = 0.9, parallel_cores = 1, executor = None, backend = 'process'):
     '''
     Scores a given query against the library, returning the distance between the query and each
     time series in the corresponding index of the library.
@@ -143,8 +389,12 @@ def score(q, C, metric = 'dtw', w = 0.9, parallel_cores = 1):
         q (Sequence[float]): Time series to query, shape = (q_length,).
         C (Sequence[Sequence[float]]): Library of time series, shape = (n_instances, length).
         w (Union[int, float]): Window constraint for distance functions. Defaults to 0.9.
-        metric (str): Distance metric for comparison, either 'dtw' or 'euclidean'. Defaults to 'dtw'.
+        metric (str): Distance metric for comparison: 'dtw', 'euclidean', 'z_euclidean' or a registered metric. Defaults to 'dtw'.
         parallel_cores (int): The number of cores to use for parallel processing. Defaults to 1. If 1, a sequential procedure is implemented.
+        executor (Executor, optional): A persistent worker pool. If given, the scores are computed on its workers
+            and `parallel_cores` is ignored. Defaults to None.
+        backend (str, optional): 'process' to parallelize with a multiprocessing pool, or 'thread' to run
+            compiled kernels on `parallel_cores` threads sharing the library, as in `query`. Defaults to 'process'.
     
     Returns:
         Sequence[float]: An array of scores, each representing the distance between the query and a time series in the library.
@@ -158,54 +408,437 @@ def score(q, C, metric = 'dtw', w = 0.9, parallel_cores = 1):
         >>> score(q, C, metric='euclidean', w=1, parallel_cores=2)
         [2.0, 1.0, 3.0]
     '''
-    if parallel_cores == 1:
+    check_backend(backend)
+
+    if executor is not None:
+        return executor.score(q, C, metric, w)
+
+    elif backend == 'thread':
+        return thread_score(q, C, metric, w, parallel_cores)
+
+    elif parallel_cores == 1:
         return sequential_score(q, C, metric, w)
     
     elif type(parallel_cores) == int and 0 < parallel_cores:
-        return parallel_score(q, C, metric, w)
+        return parallel_score(q, C, metric, w, parallel_cores)
     
     else:
         print('Parallel_cores must be a positive integer.')
 
 
+# --------------------------------------------------------------------------------
+# pairwise_distances()
+# --------------------------------------------------------------------------------
+
+TILE_SIZE = 128
+
+def condensed_index(n, i, j):
+    '''
+    Position of the pair (i, j), i < j, in a condensed distance buffer of n items.
+    '''
+    return n*i - i*(i+1)//2 + (j - i - 1)
+
+
+def tile_bounds(n, tile_size = TILE_SIZE):
+    '''
+    Yields the (i0, i1, j0, j1) bounds of the tiles covering the upper triangle
+    of an n x n distance matrix.
+    '''
+    for i0 in range(0, n, tile_size):
+        for j0 in range(i0, n, tile_size):
+            yield i0, min(i0 + tile_size, n), j0, min(j0 + tile_size, n)
+
+
+def tile_distances(rows, cols, offset, metric = 'dtw', w = 0.9, exclusion = 0):
+    '''
+    Computes the distances between two blocks of candidates, where the columns start `offset`
+    candidates after the rows. Cells on or below the diagonal of the distance matrix are left
+    as nan, so that each pair is only ever computed once, as are the trivial matches within
+    `exclusion` candidates of the diagonal.
+    '''
+    block = np.full((len(rows), len(cols)), np.nan)
+    for a in range(len(rows)):
+        start = max(0, a - offset + 1 + exclusion)
+        if is_batch(cols):
+            if start < len(cols):
+                block[a, start:] = batch_metrics[metric](rows[a], cols[start:], w = w)
+        else:
+            for b in range(start, len(cols)):
+                block[a, b] = metrics[metric](rows[a], cols[b], w = w)
+    return block
+
+
+def tile_worker(args):
+    bounds, rows, cols, metric, w, exclusion = args
+    return bounds, tile_distances(rows, cols, bounds[2] - bounds[0], metric, w, exclusion)
+
+
+def tile_size_for(n, parallel_cores):
+    '''
+    Shrinks the tiles for small libraries so that every core receives work.
+    '''
+    if parallel_cores > 1:
+        return max(1, min(TILE_SIZE, -(-n // (2 * parallel_cores))))
+    return TILE_SIZE
+
+
+def iter_tiles(C, metric = 'dtw', w = 0.9, parallel_cores = 1, exclusion = 0):
+    '''
+    Yields ((i0, i1, j0, j1), block) for every tile in the upper triangle of the
+    distance matrix of C. Tiles are computed in a process pool when parallel_cores > 1,
+    shipping only the two blocks of candidates each tile needs.
+    '''
+    n = len(C)
+    tiles = tile_bounds(n, tile_size_for(n, parallel_cores))
+
+    if parallel_cores > 1:
+        tasks = ((b, C[b[0]:b[1]], C[b[2]:b[3]], metric, w, exclusion) for b in tiles)
+        with process_pool(find_pool_size(parallel_cores)) as pool:
+            yield from pool.imap_unordered(tile_worker, tasks)
+
+    else:
+        for b in tiles:
+            yield b, tile_distances(C[b[0]:b[1]], C[b[2]:b[3]], b[2] - b[0], metric, w, exclusion)
+
+
+def pairwise_row_sums(C, metric = 'dtw', w = 0.9, parallel_cores = 1, exclusion = 0):
+    '''
+    Computes the sum of the distances from each time series in C to all others, except
+    the trivial matches within `exclusion` positions of it. Only the upper triangle is
+    computed, and each tile is discarded once it has been added to the row sums. For an
+    asymmetric metric, every row is computed in full instead.
+    '''
+    if not is_symmetric(metric):
+        return candidate_sums(C, np.arange(len(C)), metric, w, parallel_cores, None, exclusion)[0]
+
+    sums = np.zeros(len(C))
+    for (i0, i1, j0, j1), block in iter_tiles(C, metric, w, parallel_cores, exclusion):
+        sums[i0:i1] += np.nansum(block, axis = 1)
+        sums[j0:j1] += np.nansum(block, axis = 0)
+    return sums
+
+
+def pairwise_distances(C, metric = 'dtw', w = 0.9, parallel_cores = 1):
+    '''
+    Computes the distance between every pair of time series in a library. As the distance
+    metrics are symmetric, each pair is only computed once, and the result is returned in 
+    condensed form: the upper triangle of the distance matrix, row by row.
+
+    Parameters:
+        C (Sequence[Sequence[float]]): Library of time series, shape = (n_instances, length).
+        metric (str, optional): Distance metric for comparison: 'dtw', 'euclidean', 'z_euclidean' or a registered metric. Defaults to 'dtw'.
+        w (float, optional): Window constraint for the distance function. Defaults to 0.9.
+        parallel_cores (int, optional): The number of cores to use for parallel processing. Defaults to 1.
+
+    Returns:
+        np.ndarray: The condensed distance matrix, shape = (n_instances * (n_instances - 1) / 2,).
+        The distance between C[i] and C[j], i < j, is at index `condensed_index(n_instances, i, j)`.
+        The layout matches scipy.spatial.distance.pdist, so scipy.spatial.distance.squareform 
+        and scipy.cluster.hierarchy.linkage accept it directly.
+
+    Raises:
+        ValueError: If the metric was registered as asymmetric.
+
+    Examples:
+        >>> C = [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
+        >>> pairwise_distances(C, metric='euclidean', w=1)
+        array([ 5.19615242, 10.39230485,  5.19615242])
+    '''
+    if not is_symmetric(metric):
+        raise ValueError(f'The condensed distance matrix requires a symmetric metric, and {metric!r} is not.')
+
+    n = len(C)
+    condensed = np.empty(n*(n-1)//2)
+
+    for (i0, i1, j0, j1), block in iter_tiles(C, metric, w, parallel_cores):
+        for a in range(i1 - i0):
+            i = i0 + a
+            start = max(j0, i + 1)
+            if start < j1:
+                k = condensed_index(n, i, start)
+                condensed[k : k + j1 - start] = block[a, start - j0:]
+
+    return condensed
+
+
 # --------------------------------------------------------------------------------
 # pairwise_argmin()
 # --------------------------------------------------------------------------------
 
-def pairwise_argmin_worker(args):
-    return sum(sequential_score(*args))
+def match_counts(n, exclusion = 0):
+    '''
+    The number of candidates each of n candidates is compared to when the trivial matches,
+    within `exclusion` positions of it, are skipped.
+    '''
+    i = np.arange(n)
+    return (n - 1) - np.minimum(i, exclusion) - np.minimum(n - 1 - i, exclusion)
+
+
+def match_means(sums, counts):
+    '''
+    The mean distance of each candidate to the `counts` candidates it was compared to, from its
+    sum of distances, or np.inf for a candidate compared to none. Without an exclusion zone,
+    every candidate is compared to all n - 1 others and the means rank candidates as the sums do.
+    '''
+    return np.where(counts > 0, sums / np.maximum(counts, 1), np.inf)
+
+
+def parallel_pairwise_argmin(C, parallel_cores = 1, w = 0.9, metric = 'dtw', exclusion = 0):
+    return int(np.argmin(match_means(pairwise_row_sums(C, metric, w, parallel_cores, exclusion), match_counts(len(C), exclusion))))
+
+
+def sequential_pairwise_argmin(C, metric = 'dtw', w = 0.9, exclusion = 0):
+    return int(np.argmin(match_means(pairwise_row_sums(C, metric, w, 1, exclusion), match_counts(len(C), exclusion))))
 
 
-def parallel_pairwise_argmin(C, parallel_cores = 1, w = 0.9, metric = 'dtw'):
+MEDOID_BATCH = 32
+MEDOID_MEMO_BYTES = 32 << 20
 
-    with multiprocessing.Pool(processes = find_pool_size(parallel_cores)) as pool:
-        results = pool.map(pairwise_argmin_worker, [(q, C, metric, w) for q in C])
+def medoid_stats(n):
+    return {'candidates' : n, 'distance_calls' : 0, 'rounds' : 0}
 
-    return np.argmin(results)
 
+class PairMemo:
 
-def sequential_pairwise_argmin(C, metric = 'dtw', w = 0.9):
+    ''' The distances from each candidate drawn as a reference to the candidates still in the
+        running at the time, kept while it is in the running itself, so that the pair is not
+        computed again when it meets them as an arm. At most `max_bytes` of distances are kept;
+        once they are full, further references are not kept. '''
 
-    min_distance = float('inf')
-    min_distance_index = None
+    def __init__(self, n, max_bytes = MEDOID_MEMO_BYTES):
+        rows = int(min(n, max_bytes // (8 * max(n, 1))))
+        self.values = np.empty((rows, n))
+        self.slot = np.full(n, -1, dtype = np.int64)
+        self.free = list(range(rows - 1, -1, -1))
 
-    for i, c1 in enumerate(C):
+    def lookup(self, arms, ref):
+        ''' The kept distances from each arm to ref, nan where unknown. '''
+        known = np.full(len(arms), np.nan)
+        slots = self.slot[arms]
+        kept = slots >= 0
+        known[kept] = self.values[slots[kept], ref]
+        return known
 
-        total_distance = 0
+    def store(self, ref, arms, distances):
+        if self.slot[ref] < 0 and self.free:
+            slot = self.free.pop()
+            self.slot[ref] = slot
+            self.values[slot] = np.nan
+            self.values[slot, arms] = distances
 
-        for j, c2 in enumerate(C):
+    def keep(self, arms):
+        ''' Frees the distances of the candidates no longer in the running. '''
+        dropped = np.setdiff1d(np.flatnonzero(self.slot >= 0), arms)
+        self.free.extend(self.slot[dropped].tolist())
+        self.slot[dropped] = -1
 
-            if i != j:
-                total_distance += metrics[metric](c1, c2, w = w)
 
-        if total_distance < min_distance:
-            min_distance = total_distance
-            min_distance_index = i
+def arm_distances(C, arms, refs, metric = 'dtw', w = 0.9, memo = None):
+    '''
+    Computes the distances from each candidate in arms to each reference in refs, one
+    reference at a time against all arms. The distance of a candidate to itself is 0 and
+    is not computed, and neither are the distances kept in `memo`, a PairMemo, to which
+    the distances of the references that are arms themselves are added. For an asymmetric
+    metric, the distances are computed from each arm to the references, without the memo.
+    '''
+    arms = np.asarray(arms)
+    block = np.zeros((len(arms), len(refs)))
+
+    if not is_symmetric(metric):
+        calls = 0
+        for a, i in enumerate(arms):
+            others = np.flatnonzero(refs != i)
+            if len(others):
+                block[a, others] = sequential_score(C[i], C[refs[others]] if is_batch(C) else [C[j] for j in refs[others]], metric, w)
+            calls += len(others)
+        return block, calls
+    rows = C[arms] if is_batch(C) else None
+    calls = 0
+    for b, ref in enumerate(refs):
+        known = memo.lookup(arms, ref) if memo is not None else np.full(len(arms), np.nan)
+        own = arms == ref
+        known[own] = 0.0
+        todo = np.flatnonzero(np.isnan(known))
+        if len(todo):
+            if rows is not None:
+                known[todo] = batch_metrics[metric](C[ref], rows[todo], w = w)
+            else:
+                for a in todo:
+                    known[a] = metrics[metric](C[arms[a]], C[ref], w = w)
+        block[:, b] = known
+        calls += len(todo)
+        if memo is not None and own.any():
+            memo.store(ref, arms, known)
+    return block, calls
+
+
+def approximate_pairwise_argmin(C, metric = 'dtw', w = 0.9, delta = 0.01, budget = None, seed = None, stats = None):
+    '''
+    Finds the candidate with the minimum sum of distances by successive elimination, as in
+    Meddit and BanditPAM. Every round, all remaining candidates are compared to the same batch
+    of references, drawn without replacement from a random permutation of C. A pair of candidates
+    met again with their roles swapped reuses its distance, within the memory of a PairMemo.
+
+    Candidates are compared through their differences to an anchor, the best candidate after the
+    first round: as every candidate sees the same references, these differences vary much less
+    than the distances themselves. A candidate is eliminated once the confidence interval of its
+    mean difference lies entirely above that of another candidate. Once every reference has been
+    drawn, the means are exact. A candidate at an infinite distance from a reference, such as a
+    DTW distance between series whose lengths differ by more than the band, has an infinite sum
+    and is eliminated at once.
+
+    When the budget, or the first round alone, would reach the n * (n - 1) / 2 distances of the
+    exact search, the exact search is run instead, as it is when every remaining candidate has an infinite
+    sum while others do not.
+    '''
+    n = len(C)
+    exact = n * (n - 1) // 2
+
+    def exact_search():
+        stats['distance_calls'] += exact
+        stats['rounds'] += 1
+        return sequential_pairwise_argmin(C, metric, w)
+
+    if (budget is not None and budget >= exact) or n * min(MEDOID_BATCH, n - 1) >= exact:
+        return exact_search()
+
+    order = np.random.default_rng(seed).permutation(n)
+
+    arms = np.arange(n)
+    sums, differences, squares = np.zeros(n), np.zeros(n), np.zeros(n)
+    log_term = np.log(2 * n * (n // MEDOID_BATCH + 1) / delta) # union bound over the candidates and the rounds
+    anchor = None
+    memo = PairMemo(n)
+    t = 0
+
+    while len(arms) > 1 and t < n and (budget is None or stats['distance_calls'] < budget):
+
+        size = MEDOID_BATCH if budget is None else min(MEDOID_BATCH, max(1, (budget - stats['distance_calls']) // len(arms)))
+        refs = order[t : t + size]
+        block, calls = arm_distances(C, arms, refs, metric, w, memo)
+        stats['distance_calls'] += calls
+        stats['rounds'] += 1
+        t += len(refs)
+
+        finite = np.isfinite(block).all(axis = 1)
+        if not finite.all():
+            sums[arms[~finite]] = np.inf
+            arms, block = arms[finite], block[finite]
+            if not len(arms):
+                # With every sum infinite, the exact search returns the first candidate
+                return 0 if np.isinf(sums).all() else exact_search()
+
+        if anchor is None:
+            anchor = arms[np.argmin(block.sum(axis = 1))]
+        if anchor in arms:
+            anchor_row = block[np.searchsorted(arms, anchor)]
+        else:
+            anchor_row, calls = arm_distances(C, [anchor], refs, metric, w, memo)
+            stats['distance_calls'] += calls
+            # Any value common to all candidates keeps their differences comparable,
+            # so the anchor's infinite distances are replaced by the references' mean
+            anchor_row = np.where(np.isfinite(anchor_row[0]), anchor_row[0], block.mean(axis = 0))
+
+        sums[arms] += block.sum(axis = 1)
+        differences[arms] += (block - anchor_row).sum(axis = 1)
+        squares[arms] += ((block - anchor_row)**2).sum(axis = 1)
+
+        # Empirical standard deviations, with the finite population correction
+        # closing the intervals as the references run out
+        means = differences[arms] / t
+        sigma = np.sqrt(np.maximum(squares[arms] / t - means**2, 0))
+        radius = sigma * np.sqrt(2 * log_term / t) * np.sqrt((n - t) / max(n - 1, 1))
+
+        arms = arms[means - radius <= np.min(means + radius)]
+        memo.keep(arms)
+
+    return int(arms[np.argmin(sums[arms])])
+
+
+def zone_bounds(n, i, exclusion = 0):
+    ''' The bounds [start, stop) of candidate i and its trivial matches within `exclusion` positions of it. '''
+    return max(0, i - exclusion), min(n, i + exclusion + 1)
+
+
+def outside_sum(C, i, metric = 'dtw', w = 0.9, exclusion = 0):
+    '''
+    The sum of the distances from candidate i to all candidates but itself and its trivial
+    matches, which are not computed. Returns the sum and the number of distances computed.
+    '''
+    start, stop = zone_bounds(len(C), i, exclusion)
+    total = 0.0
+    for rest in (C[:start], C[stop:]):
+        if len(rest):
+            total += np.sum(sequential_score(C[i], rest, metric, w))
+    return total, len(C) - (stop - start)
+
+
+def candidate_sums_worker(args):
+    survivors, C, metric, w, exclusion = args
+    return [outside_sum(C, i, metric, w, exclusion) for i in survivors]
+
+
+def candidate_sums(C, survivors, metric = 'dtw', w = 0.9, parallel_cores = 1, executor = None, exclusion = 0):
+    '''
+    Computes the sum of the distances from each candidate in survivors to all of C, except
+    itself and the trivial matches within `exclusion` positions of it. Returns the sums and
+    the number of distances computed. The Executor scores whole rows, of which the trivial
+    matches are left out of the sums.
+    '''
+    if executor is not None:
+        scores = executor.score_many([C[i] for i in survivors], C, metric, w)
+        bounds = [zone_bounds(len(C), i, exclusion) for i in survivors]
+        sums = np.array([np.sum(row[:start]) + np.sum(row[stop:]) for row, (start, stop) in zip(scores, bounds)])
+        return sums, scores.size
+
+    if parallel_cores > 1:
+        pool_size = find_pool_size(parallel_cores)
+        tasks = [(survivors[start:stop], C, metric, w, exclusion) for start, stop in chunk_bounds(len(survivors), pool_size)]
+        with process_pool(pool_size) as pool:
+            results = [result for chunk in pool.map(candidate_sums_worker, tasks) for result in chunk]
+    else:
+        results = candidate_sums_worker((survivors, C, metric, w, exclusion))
 
-    return min_distance_index
+    return np.array([total for total, _ in results]), sum(calls for _, calls in results)
 
 
-def pairwise_argmin(C, parallel_cores = 1, w = 0.9, metric = 'dtw'):
+def multiresolution_pairwise_argmin(C, metric = 'dtw', w = 0.9, levels = 3, keep = 0.1, parallel_cores = 1, executor = None, stats = None, exclusion = 0):
+    '''
+    Finds the candidate with the minimum sum of distances coarse to fine. At the coarsest level,
+    every candidate is reduced by PAA to 1 / 2**(levels - 1) of its length and the row sums of all
+    pairs are computed. At each finer level, the resolution doubles and only the best `keep` fraction
+    of the remaining candidates is scored against all candidates. The last level is the full
+    resolution, so the winner's sum of distances is exact.
+    '''
+    n = len(C)
+    length = C.shape[1] if is_batch(C) else min(len(c) for c in C)
+    survivors = np.arange(n)
+    counts = match_counts(n, exclusion)
+
+    for level in range(levels):
+        segments = max(1, length >> (levels - 1 - level))
+        reduced = C if level == levels - 1 else paa(C, segments)
+
+        if level == 0:
+            if executor is not None:
+                sums = executor.row_sums(reduced, metric, w, exclusion)
+            else:
+                sums = pairwise_row_sums(reduced, metric, w, parallel_cores, exclusion)
+            stats['distance_calls'] += int(counts.sum()) // (2 if is_symmetric(metric) else 1)
+        else:
+            count = max(1, int(np.ceil(len(survivors) * keep)))
+            survivors = survivors[np.argsort(means, kind = 'stable')[:count]]
+            sums, calls = candidate_sums(reduced, survivors, metric, w, parallel_cores, executor, exclusion)
+            stats['distance_calls'] += int(calls)
+
+        means = match_means(sums, counts[survivors])
+        stats['rounds'] += 1
+        stats['kept'].append(len(survivors))
+
+    return int(survivors[np.argmin(means)])
+
+
+def pairwise_argmin(C, parallel_cores = 1, w = 0.9, metric = 'dtw', executor = None, approximate = False, delta = 0.01, budget = None, seed = None, levels = 1, keep = 0.1, return_stats = False, backend = 'process', exclusion = 0):
     '''
     Computes the pairwise minimum argument (argmin) for each pair in a collection
     of time series based on a specified distance metric. This function can operate
@@ -223,25 +856,94 @@ def pairwise_argmin(C, parallel_cores = 1, w = 0.9, metric = 'dtw'):
         metric (str, optional): The distance metric to use for comparing time series. Supported
             values include 'dtw' for Dynamic Time Warping and 'euclidean' for the Euclidean distance.
             Defaults to 'dtw'.
+        executor (Executor, optional): A persistent worker pool. If given, the distances are computed
+            on its workers and `parallel_cores` is ignored. Defaults to None.
+        approximate (bool, optional): If True, the medoid is found by successive elimination over
+            sampled distances instead of computing all pairs, see the Note. Defaults to False.
+        delta (float, optional): With `approximate`, the probability of not returning the exact medoid
+            when the budget is not exhausted. Defaults to 0.01.
+        budget (int, optional): With `approximate`, the maximum number of distance calls. Once it is
+            reached, the candidate with the lowest estimated mean distance is returned. Defaults to None, no limit.
+        seed (int, optional): With `approximate`, the seed of the sampling. Defaults to None.
+        levels (int, optional): If greater than 1, the candidates are pruned coarse to fine over this many
+            resolutions, see the Note. Defaults to 1, the full resolution only.
+        keep (float, optional): With `levels`, the fraction of the candidates kept at each finer level.
+            Defaults to 0.1.
+        return_stats (bool, optional): If True, also returns the number of candidates, of distance calls
+            ('distance_calls') and of elimination rounds or resolution levels ('rounds'), and with
+            `levels`, the number of candidates scored at each level ('kept'). Defaults to False.
+        backend (str, optional): 'process' to parallelize with a multiprocessing pool, or 'thread' to run
+            compiled kernels on `parallel_cores` threads sharing the library for the exact
+            search, as in `query`. Defaults to 'process'.
+        exclusion (int, optional): The exclusion zone, for candidates in the order of their position
+            in a series, such as overlapping windows: each candidate is not compared to the `exclusion`
+            candidates on either side of it, its trivial matches, and candidates are ranked by their
+            mean distance to the others. Defaults to 0, comparing all pairs.
 
     Returns:
-        A structure (list, array, etc.) containing the index of the closest time series in C for each
-        time series in the collection, based on the specified metric. The exact type of the return
-        value depends on the implementation of the sequential or parallel argmin functions.
+        int: The index of the time series in C with the minimum sum of distances to all others.
+        dict: Only if `return_stats` is True. The counters of the search.
 
     Raises:
-        ValueError: If `parallel_cores` is not a positive integer.
+        ValueError: If `parallel_cores` is not a positive integer, or if `exclusion` is given with `approximate`.
 
     Examples:
         >>> C = [[0, 1, 2], [3, 4, 5], [6, 7, 8]]
         >>> pairwise_argmin(C, parallel_cores=2, w=1, metric='euclidean')
-        [1, 2, 0]  # Example output; actual will depend on the implementation of distance calculation.
+        1
+        >>> pairwise_argmin(C, w=1, metric='euclidean', approximate=True, return_stats=True)
+        (1, {'candidates': 3, 'distance_calls': 3, 'rounds': 1})
+
+    Note:
+        The exact search computes all n * (n - 1) / 2 distances. The approximate search compares
+        all candidates against a growing random sample of references, and eliminates those whose
+        mean distance is confidently above the best. When the medoid stands out, most candidates are
+        discarded after a few batches and the number of distance calls grows close to linearly with n;
+        when many candidates are nearly tied, it approaches that of the exact search. For small libraries,
+        or a budget of at least n * (n - 1) / 2 calls, it runs the exact search instead. It always runs
+        sequentially, ignoring `parallel_cores` and `executor`.
+
+        With `levels` > 1, the candidates are ranked by their sum of distances on piecewise aggregate
+        approximations (PAA) of 1 / 2**(levels - 1) of their length, then at each finer level, with
+        the resolution doubled, only the best `keep` fraction is scored again against all candidates.
+        The last level is the full resolution, so the returned candidate's sum is exact, although the
+        true medoid may have been pruned at a coarse level.
     '''
-    if parallel_cores > 1:
-        return parallel_pairwise_argmin(C, parallel_cores = parallel_cores, w = w, metric = metric)
-    
-    elif parallel_cores == 1:
-        return sequential_pairwise_argmin(C, metric = metric, w = w)
-    
+    check_backend(backend)
+    stats = medoid_stats(len(C))
+
+    if approximate and exclusion:
+        raise ValueError('The approximate search does not support an exclusion zone.')
+
+    if approximate:
+        index = approximate_pairwise_argmin(C, metric, w, delta, budget, seed, stats)
+
+    elif levels > 1:
+        stats['kept'] = []
+        index = multiresolution_pairwise_argmin(C, metric, w, levels, keep, parallel_cores, executor, stats, exclusion)
+
     else:
-        raise ValueError('Parallel cores should be a positive integer.')
\ No newline at end of file
+        counts = match_counts(len(C), exclusion)
+
+        if executor is not None:
+            index = int(np.argmin(match_means(executor.row_sums(C, metric, w, exclusion), counts)))
+
+        elif backend == 'thread':
+            index = int(np.argmin(match_means(thread_row_sums(C, metric, w, parallel_cores, exclusion), counts)))
+
+        elif parallel_cores > 1:
+            index = parallel_pairwise_argmin(C, parallel_cores = parallel_cores, w = w, metric = metric, exclusion = exclusion)
+
+        elif parallel_cores == 1:
+            index = sequential_pairwise_argmin(C, metric = metric, w = w, exclusion = exclusion)
+
+        else:
+            raise ValueError('Parallel cores should be a positive integer.')
+
+        stats['distance_calls'] = int(counts.sum()) // (2 if is_symmetric(metric) else 1)
+        stats['rounds'] = 1
+
+    if return_stats:
+        return index, stats
+
+    return index
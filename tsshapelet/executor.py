@@ -0,0 +1,234 @@
+from .comparator import add_stats, chunk_bounds, find_pool_size, merge_topk, process_pool, nearest_k, query_stats, sequential_score, tile_bounds, tile_distances, tile_size_for, zone_bounds
+from .metrics import is_symmetric
+from .library import RaggedLibrary
+from .utils import float_dtype
+from multiprocessing import resource_tracker, shared_memory
+import os, numpy as np
+
+# --------------------------------------------------------------------------------
+# Shared memory library
+# --------------------------------------------------------------------------------
+
+class SharedLibrary:
+
+    ''' A library of time series of possibly different lengths, stored once in shared
+        memory as a flat buffer of values and an array of offsets. Workers attach to it
+        by name, so only its token is ever pickled. Values are stored in float32 if every
+        series is float32, else in float64.'''
+
+    def __init__(self, C):
+        lengths = np.array([len(c) for c in C], dtype = np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        dtype = float_dtype(C)
+
+        self.offsets_shm = shared_memory.SharedMemory(create = True, size = max(1, offsets.nbytes))
+        self.values_shm = shared_memory.SharedMemory(create = True, size = max(1, int(offsets[-1]) * dtype.itemsize))
+
+        np.ndarray(offsets.shape, np.int64, self.offsets_shm.buf)[:] = offsets
+        values = np.ndarray((int(offsets[-1]),), dtype, self.values_shm.buf)
+        for c, start, stop in zip(C, offsets[:-1], offsets[1:]):
+            values[start:stop] = c
+
+        self.token = ('shared', self.offsets_shm.name, self.values_shm.name, len(C), int(offsets[-1]), dtype.str)
+
+    def __len__(self):
+        return self.token[3]
+
+    def close(self):
+        for shm in (self.offsets_shm, self.values_shm):
+            shm.close()
+            shm.unlink()
+
+
+def shape_of(C):
+    ''' The shape of a library, or its number of series if they are not stacked in an array. '''
+    return C.shape if isinstance(C, np.ndarray) else len(C)
+
+
+def attach(token):
+    '''
+    Attaches to a library from a worker: either a shared memory library, returned as a
+    list of read-only array views, or a RaggedLibrary, opened from disk. The most recently
+    used library stays attached between tasks.
+    '''
+    global attached
+
+    if attached is not None and attached[0] == token:
+        return attached[2]
+
+    if attached is not None:
+        for shm in attached[1]:
+            shm.close()
+
+    if token[0] == 'ragged':
+        _, path, start, stop = token
+        attached = (token, (), RaggedLibrary(path, start, stop))
+        return attached[2]
+
+    _, offsets_name, values_name, n, size, dtype = token
+    offsets_shm = shared_memory.SharedMemory(name = offsets_name)
+    values_shm = shared_memory.SharedMemory(name = values_name)
+    offsets = np.ndarray((n+1,), np.int64, offsets_shm.buf)
+    values = np.ndarray((size,), np.dtype(dtype), values_shm.buf)
+    values.flags.writeable = False
+
+    C = [values[offsets[i]:offsets[i+1]] for i in range(n)]
+    attached = (token, (offsets_shm, values_shm), C)
+    return C
+
+attached = None
+
+
+# --------------------------------------------------------------------------------
+# Worker tasks
+# --------------------------------------------------------------------------------
+
+def score_task(args):
+    token, start, stop, queries, metric, w = args
+    C = attach(token)[start:stop]
+    return start, [sequential_score(q, C, metric, w) for q in queries]
+
+
+def topk_task(args):
+    token, start, stop, queries, k, metric, w = args
+    C = attach(token)[start:stop]
+    results = []
+    for q in queries:
+        stats = query_stats(stop - start)
+        best = nearest_k(q, C, k, w, metric, stats)
+        results.append(([(dist, start + i) for dist, i in best], stats))
+    return results
+
+
+def tile_task(args):
+    token, bounds, metric, w, exclusion = args
+    C = attach(token)
+    i0, i1, j0, j1 = bounds
+    return bounds, tile_distances(C[i0:i1], C[j0:j1], j0 - i0, metric, w, exclusion)
+
+
+# --------------------------------------------------------------------------------
+# Executor
+# --------------------------------------------------------------------------------
+
+class Executor:
+
+    ''' A long-lived pool of worker processes for `query`, `score` and `pairwise_argmin`.
+
+        The library is copied once into shared memory and workers receive only index
+        ranges, so nothing proportional to the library is pickled per task. Workers
+        stay warm between calls: their numba kernels are compiled once and their
+        distance caches persist.
+
+        Examples:
+            >>> with Executor(parallel_cores = 4) as executor:
+            ...     index = query(q, C, executor = executor)
+            ...     scores = score(q, C, executor = executor)'''
+
+    def __init__(self, parallel_cores = None):
+        self.processes = find_pool_size(parallel_cores or os.cpu_count())
+
+        # Workers must share the parent's resource tracker, or each would try to
+        # clean up the shared memory it attached to when it exits
+        resource_tracker.ensure_running()
+        self.pool = process_pool(self.processes)
+        self.library = None
+        self.source = None
+        self.shape = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def load(self, C, reload = False):
+        '''
+        Places a library in shared memory. Passing the same library object again, with the
+        same shape, is free; a different object replaces the previous library. The contents
+        are not compared: after changing a library in place, pass `reload = True`, or call
+        `release`, for the next search to copy it again. A RaggedLibrary is not copied: the
+        workers open it from disk.
+
+        Returns:
+            SharedLibrary or RaggedLibrary: The library the workers attach to.
+        '''
+        if reload or C is not self.source or shape_of(C) != self.shape:
+            self.release()
+            self.library = C if isinstance(C, RaggedLibrary) else SharedLibrary(C)
+            self.source, self.shape = C, shape_of(C)
+        return self.library
+
+    def release(self):
+        ''' Frees the shared memory of the current library, so that the next search copies its library again. '''
+        if isinstance(self.library, SharedLibrary):
+            self.library.close()
+        self.library = None
+        self.source = None
+        self.shape = None
+
+    def close(self):
+        ''' Shuts the workers down and frees the shared memory. '''
+        self.pool.close()
+        self.pool.join()
+        self.release()
+
+    def score(self, q, C, metric = 'dtw', w = 0.9):
+        return self.score_many([q], C, metric, w)[0]
+
+    def score_many(self, queries, C, metric = 'dtw', w = 0.9):
+        '''
+        Scores several queries in one pass over the library: each task scores every
+        query against one chunk. Returns an array of shape = (len(queries), len(C)).
+        '''
+        token = self.load(C).token
+        scores = np.empty((len(queries), len(C)))
+        tasks = [(token, start, stop, queries, metric, w) for start, stop in chunk_bounds(len(C), self.processes)]
+        for start, results in self.pool.imap_unordered(score_task, tasks):
+            for row, result in zip(scores, results):
+                row[start:start + len(result)] = result
+        return scores
+
+    def query_topk(self, q, C, k = 1, w = 0.9, metric = 'dtw', stats = None):
+        return self.query_topk_many([q], C, k, w, metric, None if stats is None else [stats])[0]
+
+    def query_topk_many(self, queries, C, k = 1, w = 0.9, metric = 'dtw', stats = None):
+        '''
+        Searches the k nearest neighbours of several queries in one pass over the library.
+        Returns a list of sorted (distance, index) lists, one per query. If given, stats is
+        a list of counter dicts, one per query, which are updated.
+        '''
+        token = self.load(C).token
+        tasks = [(token, start, stop, queries, k, metric, w) for start, stop in chunk_bounds(len(C), self.processes)]
+        results = [[] for _ in queries]
+
+        for chunk in self.pool.imap_unordered(topk_task, tasks):
+            for i, (best, chunk_stats) in enumerate(chunk):
+                if stats is not None:
+                    add_stats(stats[i], chunk_stats)
+                results[i].append(best)
+
+        return [merge_topk(k, *result) for result in results]
+
+    def query(self, q, C, w = 0.9, metric = 'dtw', stats = None):
+        best = self.query_topk(q, C, 1, w, metric, stats)
+        return best[0][1] if best else None
+
+    def row_sums(self, C, metric = 'dtw', w = 0.9, exclusion = 0):
+        '''
+        The sum of the distances from each series to all others, except the trivial matches within
+        `exclusion` positions of it. Each pair is computed once, in tiles of the upper triangle; for
+        an asymmetric metric, every series is scored against the whole library instead.
+        '''
+        if not is_symmetric(metric):
+            scores = self.score_many([C[i] for i in range(len(C))], C, metric, w)
+            bounds = [zone_bounds(len(C), i, exclusion) for i in range(len(C))]
+            return np.array([np.sum(row[:start]) + np.sum(row[stop:]) for row, (start, stop) in zip(scores, bounds)])
+
+        token = self.load(C).token
+        sums = np.zeros(len(C))
+        tasks = ((token, bounds, metric, w, exclusion) for bounds in tile_bounds(len(C), tile_size_for(len(C), self.processes)))
+        for (i0, i1, j0, j1), block in self.pool.imap_unordered(tile_task, tasks):
+            sums[i0:i1] += np.nansum(block, axis = 1)
+            sums[j0:j1] += np.nansum(block, axis = 0)
+        return sums
@@ -1,4 +1,5 @@
 from .utils import utils, np
+from .jit import njit
 
 # --------------------------------------------------------------------------------
 # Helper methods for statistical feature extraction in the TimeSeries class 
@@ -69,6 +70,101 @@ statistical_features = {'min': np.min,
                         'iqr': iqr
                         }
 
+# --------------------------------------------------------------------------------
+# Batched statistical feature extraction over many series
+# --------------------------------------------------------------------------------
+
+batch_feature_names = ('min', 'max', 'mean', 'median', 'var', 'std', 'skewness', 'kurtosis', 'iqr')
+
+@njit
+def single_pass_moments(values, offsets):
+    '''
+    Computes the min, max, mean and the 2nd, 3rd and 4th central moments of each series in a 
+    single pass, using the online update of Terriberry (2007).
+    
+    Returns:
+        moments: np.ndarray, shape = (n_instances, 6)
+    '''
+    out = np.full((len(offsets) - 1, 6), np.nan)
+    for k in range(len(offsets) - 1):
+        n, mean, m2, m3, m4 = 0, 0.0, 0.0, 0.0, 0.0
+        low, high = np.inf, -np.inf
+        for x in values[offsets[k]:offsets[k+1]]:
+            n1 = n
+            n += 1
+            delta = x - mean
+            delta_n = delta / n
+            delta_n2 = delta_n * delta_n
+            term = delta * delta_n * n1
+            mean += delta_n
+            m4 += term * delta_n2 * (n*n - 3*n + 3) + 6 * delta_n2 * m2 - 4 * delta_n * m3
+            m3 += term * delta_n * (n - 2) - 3 * delta_n * m2
+            m2 += term
+            low, high = min(low, x), max(high, x)
+        if n > 0:
+            out[k, 0], out[k, 1], out[k, 2] = low, high, mean
+            out[k, 3], out[k, 4], out[k, 5] = m2 / n, m3 / n, m4 / n
+    return out
+
+
+def partitioned_quantiles(row, quantiles, axis = -1):
+    '''
+    Computes several quantiles (with linear interpolation, as np.quantile) from a single
+    partition of the data along an axis. The quantiles are along the first axis of the result.
+    '''
+    n = row.shape[axis]
+    positions = np.asarray(quantiles) * (n - 1)
+    lower, upper = np.floor(positions).astype(int), np.ceil(positions).astype(int)
+    part = np.partition(row, np.unique(np.concatenate([lower, upper])), axis = axis)
+    low, high = np.take(part, lower, axis = axis), np.take(part, upper, axis = axis)
+    return np.moveaxis(low + (high - low) * (positions - lower), axis, 0)
+
+
+def batch_statistical_features(C):
+    '''
+    Computes the statistical features of many series at once. The moments of each series are
+    computed in a single compiled pass, and the median and quartiles from a single partition,
+    instead of one pass per feature as with `statistical_features`.
+
+    Parameters:
+        C (array-like): A 2-D array of series, shape = (n_instances, length), or a ragged
+            sequence of series of different lengths.
+
+    Returns:
+        features: np.ndarray, shape = (n_instances, len(batch_feature_names)), column-oriented
+            (Fortran order), so that each feature is contiguous.
+        names: tuple, the name of each column, matching the keys of `statistical_features`.
+
+    Examples:
+        >>> X, names = batch_statistical_features(windows)
+        >>> pd.DataFrame(X, columns = names)
+    '''
+    values, offsets = utils['pack'](C)
+    moments = single_pass_moments(values, offsets)
+    count = len(offsets) - 1
+
+    features = np.full((count, len(batch_feature_names)), np.nan, order = 'F')
+    features[:, 0], features[:, 1], features[:, 2] = moments[:, 0], moments[:, 1], moments[:, 2]
+
+    var, m3, m4 = moments[:, 3], moments[:, 4], moments[:, 5]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        features[:, 4], features[:, 5] = var, np.sqrt(var)
+        features[:, 6], features[:, 7] = m3 / var**1.5, m4 / var**2
+
+    # One partition per batch for equal lengths, one per series otherwise
+    lengths = np.diff(offsets)
+    if count and np.all(lengths == lengths[0]) and lengths[0] > 0:
+        q1, median, q3 = partitioned_quantiles(values.reshape(count, lengths[0]), [0.25, 0.5, 0.75], axis = 1)
+    else:
+        q1, median, q3 = np.full(count, np.nan), np.full(count, np.nan), np.full(count, np.nan)
+        for k in range(count):
+            if lengths[k] > 0:
+                q1[k], median[k], q3[k] = partitioned_quantiles(values[offsets[k]:offsets[k+1]], [0.25, 0.5, 0.75])
+
+    features[:, 3], features[:, 8] = median, q3 - q1
+    return features, batch_feature_names
+
+
 # --------------------------------------------------------------------------------
 # Helper methods for time series feature extraction in the TimeSeries class 
 # --------------------------------------------------------------------------------
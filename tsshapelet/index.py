@@ -0,0 +1,446 @@
+from .utils import as_float
+from .metrics import ed_batch, dtw_instrumented, envelope, lb_kim_rows, lb_keogh_rows
+import heapq, numpy as np
+
+# --------------------------------------------------------------------------------
+# Helpers
+# --------------------------------------------------------------------------------
+
+def library_array(C):
+    '''
+    The library as a 2-D float array, checking that every series has the same length.
+    '''
+    try:
+        data = as_float(C if isinstance(C, np.ndarray) else np.array([np.asarray(c) for c in C]))
+    except ValueError:
+        data = None
+    if data is None or data.ndim != 2:
+        raise ValueError('An index requires a library of time series of the same length.')
+    return np.array(data, dtype = np.float64)
+
+
+class Rows:
+
+    ''' A 2-D array of rows that grows by doubling its capacity. '''
+
+    def __init__(self, data):
+        self.buffer = data
+        self.size = len(data)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def array(self):
+        return self.buffer[:self.size]
+
+    def append(self, rows):
+        if self.size + len(rows) > len(self.buffer):
+            buffer = np.empty((max(2 * len(self.buffer), self.size + len(rows)), self.buffer.shape[1]))
+            buffer[:self.size] = self.array
+            self.buffer = buffer
+        self.buffer[self.size:self.size + len(rows)] = rows
+        self.size += len(rows)
+        return np.arange(self.size - len(rows), self.size)
+
+
+def push(heap, k, dist, index):
+    ''' Offers a candidate to a bounded heap of (-distance, -index), as in `nearest_k`. '''
+    if dist == np.inf:
+        return
+    if len(heap) < k:
+        heapq.heappush(heap, (-dist, -index))
+    elif dist < -heap[0][0]:
+        heapq.heapreplace(heap, (-dist, -index))
+
+
+def radius(heap, k):
+    return -heap[0][0] if len(heap) == k else np.inf
+
+
+def topk_arrays(heap):
+    best = sorted((-dist, -index) for dist, index in heap)
+    return np.array([i for _, i in best], dtype = int), np.array([dist for dist, _ in best], dtype = float)
+
+
+def check_query(q, length):
+    q = as_float(q)
+    if q.ndim != 1 or len(q) != length:
+        raise ValueError(f'The query must have the length of the indexed series, {length}.')
+    return q
+
+
+# --------------------------------------------------------------------------------
+# Vantage-point tree for the Euclidean distance
+# --------------------------------------------------------------------------------
+
+class VPTree:
+
+    ''' A vantage-point tree over a library of time series of the same length, answering
+        nearest neighbour queries for the Euclidean distance (as `ed`) without scanning the
+        whole library.
+
+        Each internal node holds a vantage point and the median distance mu of its subtree
+        to it: series closer than mu go to the inside subtree, the others to the outside.
+        By the triangle inequality, a subtree is skipped whenever it cannot hold a series
+        closer than the current k-th best. Leaves hold up to about `leaf_size` series, which
+        are scanned in one vectorized pass.
+
+        Examples:
+            >>> tree = VPTree(C, leaf_size = 16)
+            >>> tree.query(q)
+            >>> indices, distances = tree.query_topk(q, k = 5)
+            >>> tree.add(new_series)
+            >>> tree.save('library.npz')
+            >>> tree = VPTree.load('library.npz')'''
+
+    def __init__(self, C, w = 1, leaf_size = 16, seed = None):
+        '''
+        Parameters:
+            C (Sequence[Sequence[float]]): Library of time series of the same length, shape = (n_instances, length).
+            w (float, optional): As in `ed`: for w <= 0.5 the series are compared every int(1/w) samples. Defaults to 1.
+            leaf_size (int, optional): The number of series under which a subtree becomes a leaf. Defaults to 16.
+            seed (int, optional): The seed for choosing the vantage points. Defaults to None.
+
+        Raises:
+            ValueError: If the time series do not all have the same length.
+        '''
+        self.w = w
+        self.leaf_size = leaf_size
+        self.rng = np.random.default_rng(seed)
+        self.rows = Rows(library_array(C))
+
+        # Nodes, as parallel lists. Leaves have a vantage point of -1 and a list of items
+        self.vantage, self.mu, self.inside, self.outside, self.items = [], [], [], [], []
+        self.build(np.arange(len(self.rows)))
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def data(self):
+        return self.rows.array
+
+    def distances(self, q, indices):
+        return ed_batch(q, self.data[indices], self.w)
+
+    def node(self, slot = None):
+        if slot is None:
+            for nodes in (self.vantage, self.mu, self.inside, self.outside, self.items):
+                nodes.append(None)
+            slot = len(self.vantage) - 1
+        return slot
+
+    def build(self, indices, slot = None):
+        '''
+        Builds the subtree of the given series, in place of the node `slot` if given.
+        '''
+        slot = self.node(slot)
+        self.vantage[slot], self.mu[slot], self.inside[slot], self.outside[slot] = -1, 0.0, -1, -1
+        self.items[slot] = list(indices)
+
+        if len(indices) <= self.leaf_size:
+            return slot
+
+        pick = self.rng.integers(len(indices))
+        vantage, rest = indices[pick], np.delete(indices, pick)
+        distances = self.distances(self.data[vantage], rest)
+        mu = float(np.median(distances))
+
+        # Series all equidistant from the vantage point cannot be split
+        if not np.any(distances < mu):
+            return slot
+
+        self.vantage[slot], self.mu[slot], self.items[slot] = int(vantage), mu, None
+        self.inside[slot] = self.build(rest[distances < mu])
+        self.outside[slot] = self.build(rest[distances >= mu])
+        return slot
+
+    def add(self, C):
+        '''
+        Adds time series to the index. Each series descends to a leaf, and leaves that outgrow
+        twice the leaf size are split.
+
+        Returns:
+            np.ndarray: The indices of the new series.
+        '''
+        indices = self.rows.append(library_array(C))
+        for i in indices:
+            x, slot = self.data[i], 0
+            while self.items[slot] is None:
+                dist = self.distances(x, [self.vantage[slot]])[0]
+                slot = self.inside[slot] if dist < self.mu[slot] else self.outside[slot]
+            self.items[slot].append(i)
+            if len(self.items[slot]) > 2 * self.leaf_size:
+                self.build(np.array(self.items[slot]), slot)
+        return indices
+
+    def query_topk(self, q, k = 10, return_stats = False):
+        '''
+        Finds the k nearest time series to q.
+
+        Returns:
+            np.ndarray: The indices of the k nearest series, sorted by distance, shape = (k,).
+            np.ndarray: Their distances to q, shape = (k,).
+            dict: Only if `return_stats` is True. The number of indexed series ('candidates') and of
+                distances computed ('distances').
+        '''
+        q = check_query(q, self.data.shape[1])
+        stats = {'candidates' : len(self), 'distances' : 0}
+        heap = []
+
+        # Nodes to visit, with a lower bound on the distance from q to their series. A node
+        # is skipped when popped if the heap has tightened past its bound since it was pushed
+        stack = [(0, 0.0)] if len(self) else []
+
+        while stack:
+            slot, bound = stack.pop()
+            if bound >= radius(heap, k):
+                continue
+
+            if self.items[slot] is not None:
+                items = self.items[slot]
+                if items:
+                    for index, dist in zip(items, self.distances(q, items)):
+                        push(heap, k, dist, index)
+                    stats['distances'] += len(items)
+                continue
+
+            vantage, mu = self.vantage[slot], self.mu[slot]
+            dist = self.distances(q, [vantage])[0]
+            stats['distances'] += 1
+            push(heap, k, dist, vantage)
+
+            # Visit the side q falls in last, so that it is popped first. By the triangle
+            # inequality, the series on the other side are at least |dist - mu| from q
+            near, far = (self.inside[slot], self.outside[slot]) if dist < mu else (self.outside[slot], self.inside[slot])
+            far_bound = max(bound, abs(dist - mu))
+            if far_bound < radius(heap, k):
+                stack.append((far, far_bound))
+            stack.append((near, bound))
+
+        indices, distances = topk_arrays(heap)
+        if return_stats:
+            return indices, distances, stats
+        return indices, distances
+
+    def query(self, q):
+        ''' The index of the nearest time series to q, or None if the index is empty. '''
+        indices, _ = self.query_topk(q, 1)
+        return int(indices[0]) if len(indices) else None
+
+    def save(self, path):
+        ''' Writes the index to a .npz file. '''
+        leaves = [items if items is not None else [] for items in self.items]
+        np.savez(path, kind = 'vptree', data = self.data, w = self.w, leaf_size = self.leaf_size,
+                 vantage = np.array(self.vantage, dtype = np.int64), mu = np.array(self.mu, dtype = float),
+                 inside = np.array(self.inside, dtype = np.int64), outside = np.array(self.outside, dtype = np.int64),
+                 leaf = np.array([items is not None for items in self.items]),
+                 leaf_offsets = np.concatenate([[0], np.cumsum([len(items) for items in leaves])]).astype(np.int64),
+                 leaf_items = np.array([i for items in leaves for i in items], dtype = np.int64))
+
+    @classmethod
+    def load(cls, path, seed = None):
+        ''' Reads an index written by `save`. '''
+        with np.load(path) as saved:
+            tree = cls.__new__(cls)
+            tree.w = saved['w'].item()
+            tree.leaf_size = int(saved['leaf_size'])
+            tree.rng = np.random.default_rng(seed)
+            tree.rows = Rows(saved['data'])
+            tree.vantage = saved['vantage'].tolist()
+            tree.mu = saved['mu'].tolist()
+            tree.inside = saved['inside'].tolist()
+            tree.outside = saved['outside'].tolist()
+            offsets, items = saved['leaf_offsets'], saved['leaf_items']
+            tree.items = [items[start:stop].tolist() if leaf else None
+                          for leaf, start, stop in zip(saved['leaf'], offsets[:-1], offsets[1:])]
+        return tree
+
+
+# --------------------------------------------------------------------------------
+# Envelope buckets for DTW
+# --------------------------------------------------------------------------------
+
+class EnvelopeIndex:
+
+    ''' An index over a library of time series of the same length for banded DTW queries.
+
+        DTW is not a metric, so the library is instead grouped into buckets of similar series,
+        each with the union of the LB_Keogh envelopes of its members. The LB_Keogh bound of the
+        query against a bucket's envelope bounds the DTW distance to all of its members from
+        below, so buckets are visited in order of their bound and the search stops at the first
+        bucket that cannot hold a closer series. Within a bucket, the cascade of `query` (LB_Kim,
+        LB_Keogh and reversed LB_Keogh) and early-abandoning DTW are applied.
+
+        Examples:
+            >>> index = EnvelopeIndex(C, w = 0.1)
+            >>> index.query(q)
+            >>> indices, distances = index.query_topk(q, k = 5)'''
+
+    def __init__(self, C, w = 0.9, bucket_size = 32, seed = None):
+        '''
+        Parameters:
+            C (Sequence[Sequence[float]]): Library of time series of the same length, shape = (n_instances, length).
+            w (float, optional): Window constraint of the DTW distance. Defaults to 0.9. Narrow windows give
+                tighter envelopes and prune more buckets.
+            bucket_size (int, optional): The number of series under which a group becomes a bucket. Defaults to 32.
+            seed (int, optional): The seed for splitting the buckets. Defaults to None.
+
+        Raises:
+            ValueError: If the time series do not all have the same length.
+        '''
+        self.w = w
+        self.bucket_size = bucket_size
+        self.rng = np.random.default_rng(seed)
+        self.rows = Rows(library_array(C))
+        self.upper, self.lower = Rows(np.empty((0, self.rows.buffer.shape[1]))), Rows(np.empty((0, self.rows.buffer.shape[1])))
+        self.add_envelopes(np.arange(len(self.rows)))
+
+        self.buckets = []
+        self.split(np.arange(len(self.rows)))
+        self.refresh()
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def data(self):
+        return self.rows.array
+
+    def add_envelopes(self, indices):
+        envelopes = [envelope(self.data[i], self.w) for i in indices]
+        self.upper.append(np.array([U for U, _ in envelopes]).reshape(len(indices), -1))
+        self.lower.append(np.array([L for _, L in envelopes]).reshape(len(indices), -1))
+
+    def split(self, indices):
+        '''
+        Splits series into buckets of similar series: recursively, each group is divided at
+        the median of the difference of its Euclidean distances to two distant pivots.
+        '''
+        groups = [np.asarray(indices)]
+        while groups:
+            group = groups.pop()
+            if len(group) <= self.bucket_size:
+                self.buckets.append(list(group))
+                continue
+
+            X = self.data[group]
+            first = X[self.rng.integers(len(group))]
+            a = X[np.argmax(ed_batch(first, X))]
+            b = X[np.argmax(ed_batch(a, X))]
+            side = ed_batch(a, X) - ed_batch(b, X)
+            order = np.argsort(side, kind = 'stable')
+            half = len(group) // 2
+            groups += [group[order[:half]], group[order[half:]]]
+
+    def refresh(self):
+        ''' Recomputes the envelope and centroid of every bucket. '''
+        self.bucket_upper = np.array([self.upper.array[items].max(axis = 0) for items in self.buckets]).reshape(len(self.buckets), -1)
+        self.bucket_lower = np.array([self.lower.array[items].min(axis = 0) for items in self.buckets]).reshape(len(self.buckets), -1)
+        self.centroids = np.array([self.data[items].mean(axis = 0) for items in self.buckets]).reshape(len(self.buckets), -1)
+
+    def add(self, C):
+        '''
+        Adds time series to the index. Each series joins the bucket with the nearest centroid,
+        widening its envelope, and buckets that outgrow twice the bucket size are split.
+
+        Returns:
+            np.ndarray: The indices of the new series.
+        '''
+        indices = self.rows.append(library_array(C))
+        self.add_envelopes(indices)
+
+        for i in indices:
+            if not self.buckets:
+                self.buckets.append([i])
+                self.refresh()
+                continue
+
+            b = int(np.argmin(ed_batch(self.data[i], self.centroids)))
+            items = self.buckets[b]
+            items.append(i)
+            self.bucket_upper[b] = np.maximum(self.bucket_upper[b], self.upper.array[i])
+            self.bucket_lower[b] = np.minimum(self.bucket_lower[b], self.lower.array[i])
+            self.centroids[b] += (self.data[i] - self.centroids[b]) / len(items)
+
+            if len(items) > 2 * self.bucket_size:
+                del self.buckets[b]
+                self.split(np.array(items))
+                self.refresh()
+
+        return indices
+
+    def query_topk(self, q, k = 10, return_stats = False):
+        '''
+        Finds the k nearest time series to q by banded DTW.
+
+        Returns:
+            np.ndarray: The indices of the k nearest series, sorted by distance, shape = (k,).
+            np.ndarray: Their distances to q, shape = (k,).
+            dict: Only if `return_stats` is True. The number of indexed series ('candidates'), of buckets
+                ('buckets') and of buckets pruned by their envelope ('buckets_pruned'), of series pruned
+                within the visited buckets ('lower_bounds'), and of DTW distances computed ('dtw').
+        '''
+        q = check_query(q, self.data.shape[1])
+        stats = {'candidates' : len(self), 'buckets' : len(self.buckets), 'buckets_pruned' : 0, 'lower_bounds' : 0, 'dtw' : 0}
+        heap = []
+
+        # LB_Keogh of the query against each bucket's envelope
+        excess = np.maximum(q - self.bucket_upper, 0) + np.maximum(self.bucket_lower - q, 0)
+        bucket_bounds = np.sqrt(np.sum(excess**2, axis = 1))
+        U, L = envelope(q, self.w)
+
+        order = np.argsort(bucket_bounds, kind = 'stable')
+        for rank, b in enumerate(order):
+            if bucket_bounds[b] >= radius(heap, k):
+                stats['buckets_pruned'] = len(order) - rank
+                break
+
+            items = np.array(self.buckets[b])
+            X = self.data[items]
+            reversed_excess = np.maximum(q - self.upper.array[items], 0) + np.maximum(self.lower.array[items] - q, 0)
+            bounds = np.maximum(np.maximum(lb_kim_rows(q, X), lb_keogh_rows(U, L, X)), np.sqrt(np.sum(reversed_excess**2, axis = 1)))
+
+            for j in np.argsort(bounds, kind = 'stable'):
+                r = radius(heap, k)
+                if bounds[j] >= r:
+                    stats['lower_bounds'] += 1
+                    continue
+                stats['dtw'] += 1
+                push(heap, k, dtw_instrumented(q, X[j], self.w, r), int(items[j]))
+
+        indices, distances = topk_arrays(heap)
+        if return_stats:
+            return indices, distances, stats
+        return indices, distances
+
+    def query(self, q):
+        ''' The index of the nearest time series to q, or None if the index is empty. '''
+        indices, _ = self.query_topk(q, 1)
+        return int(indices[0]) if len(indices) else None
+
+    def save(self, path):
+        ''' Writes the index to a .npz file. '''
+        labels = np.empty(len(self), dtype = np.int64)
+        for b, items in enumerate(self.buckets):
+            labels[items] = b
+        np.savez(path, kind = 'envelope', data = self.data, w = self.w, bucket_size = self.bucket_size, labels = labels)
+
+    @classmethod
+    def load(cls, path, seed = None):
+        ''' Reads an index written by `save`. The envelopes are recomputed. '''
+        with np.load(path) as saved:
+            index = cls.__new__(cls)
+            index.w = saved['w'].item()
+            index.bucket_size = int(saved['bucket_size'])
+            index.rng = np.random.default_rng(seed)
+            index.rows = Rows(saved['data'])
+            labels = saved['labels']
+
+        width = index.rows.buffer.shape[1]
+        index.upper, index.lower = Rows(np.empty((0, width))), Rows(np.empty((0, width)))
+        index.add_envelopes(np.arange(len(index.rows)))
+        index.buckets = [np.flatnonzero(labels == b).tolist() for b in range(labels.max() + 1 if len(labels) else 0)]
+        index.refresh()
+        return index
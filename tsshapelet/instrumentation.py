@@ -0,0 +1,109 @@
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# --------------------------------------------------------------------------------
+# Hooks
+# --------------------------------------------------------------------------------
+
+hooks = []
+
+def add_hook(callback):
+    '''
+    Registers a callback receiving every instrumentation event as callback(name, value, tags),
+    where tags is a dict describing the event. Events are only produced while at least one hook
+    is registered, so instrumentation costs nothing otherwise.
+
+    Events:
+        dtw_cells: DTW cells evaluated by one distance computation, or by all the computations of
+            one batched, thread backend or shapelet transform call. Tags: band_cells, the number of
+            cells in the Sakoe-Chiba bands, abandoned, the number of computations abandoned early,
+            and pairs, the number of computations.
+        cache_hit, cache_miss: A lookup in the distance cache. Tags: metric.
+        query_<counter>: The counters of a `query` or `query_topk` call, see `query`. Tags: metric, k.
+        phase_seconds: The wall time of a phase of a Shapelet method. Tags: phase, method.
+        pool_size: The number of processes of a pool. Tags: requested.
+
+    Events raised inside worker processes are not forwarded to the hooks of the parent process.
+    The batched kernels and the thread backend bypass the distance cache, so they raise no
+    cache events.
+
+    Examples:
+        >>> collector = MetricsCollector()
+        >>> add_hook(collector)
+        >>> shape.exhaustive_shapelet(verbose = False)
+        >>> collector.summary()
+    '''
+    if callback not in hooks:
+        hooks.append(callback)
+    return callback
+
+
+def remove_hook(callback):
+    if callback in hooks:
+        hooks.remove(callback)
+
+
+def emit(name, value, **tags):
+    for callback in hooks:
+        callback(name, value, tags)
+
+
+@contextmanager
+def timer(phase, **tags):
+    '''
+    Emits the wall time of the enclosed block as a 'phase_seconds' event.
+    '''
+    if not hooks:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        emit('phase_seconds', time.perf_counter() - start, phase = phase, **tags)
+
+
+# --------------------------------------------------------------------------------
+# Collector
+# --------------------------------------------------------------------------------
+
+class MetricsCollector:
+
+    ''' A hook accumulating events into totals and counts per event name, with phase
+        timings accumulated per phase. '''
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.band_cells = 0
+
+    def __call__(self, name, value, tags):
+        if name == 'phase_seconds':
+            name = f"phase_seconds.{tags['phase']}"
+        elif name == 'dtw_cells':
+            self.band_cells += tags['band_cells']
+        self.totals[name] += value
+        self.counts[name] += 1
+
+    def summary(self):
+        '''
+        Returns:
+            dict: The totals of every event, plus the derived 'cache_hit_rate', 'dtw_cell_ratio'
+            (cells evaluated over cells in the band) and 'query_abandon_rate' (full distance
+            computations abandoned early).
+        '''
+        summary = dict(self.totals)
+
+        lookups = summary.get('cache_hit', 0) + summary.get('cache_miss', 0)
+        if lookups:
+            summary['cache_hit_rate'] = summary.get('cache_hit', 0) / lookups
+        if self.band_cells:
+            summary['dtw_cell_ratio'] = summary.get('dtw_cells', 0) / self.band_cells
+        if summary.get('query_dtw'):
+            summary['query_abandon_rate'] = summary.get('query_abandoned', 0) / summary['query_dtw']
+
+        return summary
+
+    def clear(self):
+        self.__init__()
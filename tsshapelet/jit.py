@@ -0,0 +1,177 @@
+import functools, importlib, multiprocessing, sys, numpy as np
+
+# --------------------------------------------------------------------------------
+# Lazy numba compilation
+# --------------------------------------------------------------------------------
+
+kernels = []
+compiled = False
+
+class LazyKernel:
+
+    ''' Stands in for a numba kernel until the first kernel is called, so that importing
+        tsshapelet does not import numba. The first call compiles every kernel and
+        replaces the stand-ins in the tsshapelet modules with their dispatchers, so that
+        kernels calling each other are compiled as numba functions. '''
+
+    def __init__(self, func, options):
+        functools.update_wrapper(self, func)
+        self.py_func = func
+        self.options = options
+        self.dispatcher = None
+
+    def __call__(self, *args, **kwargs):
+        if self.dispatcher is None:
+            compile_kernels()
+        return self.dispatcher(*args, **kwargs)
+
+    def __reduce__(self):
+        return resolve, (self.py_func.__module__, self.py_func.__name__)
+
+
+def resolve(module, name):
+    return getattr(importlib.import_module(module), name)
+
+
+def njit(*args, **options):
+    '''
+    numba.njit, deferred until the first kernel is called and cached on disk by default,
+    so a new process loads compiled kernels rather than compiling them again.
+    '''
+    options.setdefault('cache', True)
+
+    def decorate(func):
+        if compiled:
+            import numba
+            return numba.njit(**options)(func)
+        kernel = LazyKernel(func, options)
+        kernels.append(kernel)
+        return kernel
+
+    if len(args) == 1 and callable(args[0]):
+        return decorate(args[0])
+    return decorate
+
+
+def prange(*args):
+    '''
+    numba.prange for kernels compiled with parallel = True. It is replaced by numba.prange
+    along with the kernels, and behaves as range until then.
+    '''
+    return range(*args)
+
+
+def compile_kernels():
+    global compiled
+    import numba
+
+    for kernel in kernels:
+        if kernel.dispatcher is None:
+            kernel.dispatcher = numba.njit(**kernel.options)(kernel.py_func)
+
+    dispatchers = {id(kernel) : kernel.dispatcher for kernel in kernels}
+    dispatchers[id(prange)] = numba.prange
+    for name, module in list(sys.modules.items()):
+        if module is None or not (name == __package__ or name.startswith(__package__ + '.')):
+            continue
+        for attr, value in list(vars(module).items()):
+            if id(value) in dispatchers:
+                setattr(module, attr, dispatchers[id(value)])
+
+    compiled = True
+
+
+def threading_layer(numba):
+    ''' The threading layer of numba's parallel kernels, or None if none has run yet. '''
+    try:
+        return numba.threading_layer()
+    except ValueError:
+        return None
+
+
+def fork_safe_threads():
+    '''
+    Selects numba's workqueue threading layer for the parallel kernels, unless a layer was
+    chosen through NUMBA_THREADING_LAYER or parallel kernels have already run. The process
+    pools fork their workers, and processes forked after the tbb layer, numba's default when
+    it is installed, hang at exit. The workqueue layer does not support launching parallel
+    kernels from several threads at once.
+    '''
+    import numba
+    if numba.config.THREADING_LAYER == 'default' and threading_layer(numba) is None:
+        numba.config.THREADING_LAYER = 'workqueue'
+
+
+def check_fork():
+    '''
+    Raises a RuntimeError before a process pool is forked if parallel kernels have run under
+    the tbb threading layer, as the forked workers would hang at exit.
+    '''
+    numba = sys.modules.get('numba')
+    if numba is None or multiprocessing.get_context().get_start_method() != 'fork':
+        return
+    if threading_layer(numba) == 'tbb':
+        raise RuntimeError("A process pool cannot be forked after numba's tbb threading layer has run, as its workers "
+                           "would hang at exit. Set NUMBA_THREADING_LAYER to 'workqueue' or 'omp', or the "
+                           "multiprocessing start method to 'spawn' or 'forkserver'.")
+
+
+# --------------------------------------------------------------------------------
+# Warmup
+# --------------------------------------------------------------------------------
+
+def warmup(dtypes = (np.float64,)):
+    '''
+    Compiles the numba kernels for the given dtypes, or loads them from the on-disk cache
+    when a previous process already compiled them, and imports scipy. Call it once at the
+    start of a short-lived process so that its first query does not pay for compilation.
+
+    Compiled kernels are cached in the __pycache__ directories of the package, or under
+    NUMBA_CACHE_DIR if it is set.
+
+    Parameters:
+        dtypes (Sequence[np.dtype], optional): The dtypes of the series to compile for. Defaults to (np.float64,).
+
+    Examples:
+        >>> import tsshapelet
+        >>> tsshapelet.warmup()
+    '''
+    from .metrics import dtw_distance, dtw_kernel, dtw_matrix, dtw_path, dtw_band_cells, envelope, lb_kim, lb_keogh, \
+        dtw_rows, dtw_rows_counted, ed_rows, lb_kim_rows, lb_keogh_rows, ed_distance, zed_distance, zed_rows
+    from .profiles import diagonal_distance_sums
+    from .features import single_pass_moments
+    from .barycenters import dba_sums
+    from .threads import score_packed, query_packed, row_sums_packed
+    from .utils import utils
+
+    fork_safe_threads()
+    utils['find_peaks'](np.sin(np.linspace(0, 20, 200)), min_dist = 10)
+
+    for dtype in dtypes:
+        I = np.linspace(0, 1, 8).astype(dtype)
+        C = np.stack([I, I[::-1]])
+        offsets = np.array([0, 8, 16], dtype = np.int64)
+        U, L = envelope(I, 0.5)
+
+        dtw_distance(I, I, 0.5, np.inf)
+        dtw_kernel(I, I, 0.5, np.inf)
+        dtw_matrix(I, I, 0.5, np.inf)
+        dtw_path(I, I, 0.5)
+        dtw_band_cells(8, 8, 0.5)
+        lb_kim(I, I)
+        lb_keogh(U, L, I, np.inf)
+        ed_distance(I, I, 0.5, np.inf)
+        zed_distance(I, I, 0.5, np.inf)
+        dtw_rows(I, C, 0.5)
+        dtw_rows_counted(I, C, 0.5)
+        ed_rows(I, C)
+        zed_rows(I, C, 0.5)
+        lb_kim_rows(I, C)
+        lb_keogh_rows(U, L, C)
+        diagonal_distance_sums(I, 4, 1, 4, 0)
+        single_pass_moments(C.reshape(-1), offsets)
+        dba_sums(I.astype(np.float64), C.reshape(-1), offsets, 0.5)
+        for euclidean in (False, True):
+            score_packed(I, C.reshape(-1), offsets, 0.5, euclidean)
+            query_packed(I, C.reshape(-1), offsets, 0.5, euclidean, 1)
+            row_sums_packed(C.reshape(-1), offsets, 0.5, euclidean, 1, 0)
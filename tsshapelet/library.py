@@ -0,0 +1,90 @@
+import os, numpy as np
+
+# --------------------------------------------------------------------------------
+# Memory-mapped ragged library
+# --------------------------------------------------------------------------------
+
+class RaggedLibrary:
+
+    ''' A library of time series of different lengths stored on disk, in a directory
+        holding a flat `values.npy` array of all samples and an `offsets.npy` array,
+        where series i spans values[offsets[i]:offsets[i+1]].
+
+        Both arrays are opened with np.memmap, so only the pages that are read are
+        loaded into memory. Indexing returns read-only array views; slicing returns a
+        RaggedLibrary over a range of series. A RaggedLibrary pickles as its path and
+        range, so it can be sent to worker processes without copying its data.
+
+        It can be passed anywhere a library C is accepted, e.g. `query`, `score`,
+        `query_topk` and `pairwise_argmin`.'''
+
+    def __init__(self, path, start = 0, stop = None):
+        self.path = path
+        self.offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode = 'r')
+        self.values = np.load(os.path.join(path, 'values.npy'), mmap_mode = 'r')
+        size = len(self.offsets) - 1
+        self.start = start
+        self.stop = size if stop is None else min(stop, size)
+
+    @classmethod
+    def write(cls, path, C, dtype = np.float64):
+        '''
+        Writes a library of time series to disk, one series at a time.
+
+        Parameters:
+            path (str): The directory to write to. It is created if needed.
+            C (Sequence[Sequence[float]]): Library of time series of any lengths.
+            dtype (np.dtype, optional): The dtype of the stored values. Defaults to np.float64.
+
+        Returns:
+            RaggedLibrary: The library, opened from disk.
+        '''
+        os.makedirs(path, exist_ok = True)
+        lengths = np.array([len(c) for c in C], dtype = np.int64)
+        offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        np.save(os.path.join(path, 'offsets.npy'), offsets)
+
+        values = np.lib.format.open_memmap(os.path.join(path, 'values.npy'), mode = 'w+', dtype = dtype, shape = (int(offsets[-1]),))
+        for c, start, stop in zip(C, offsets[:-1], offsets[1:]):
+            values[start:stop] = c
+        values.flush()
+        del values
+
+        return cls(path)
+
+    def __len__(self):
+        return max(0, self.stop - self.start)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError('RaggedLibrary slices must have a step of 1.')
+            return RaggedLibrary(self.path, self.start + start, self.start + max(start, stop))
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('RaggedLibrary index out of range.')
+
+        i = self.start + index
+        return self.values[self.offsets[i]:self.offsets[i+1]]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getstate__(self):
+        return {'path' : self.path, 'start' : self.start, 'stop' : self.stop}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'], state['start'], state['stop'])
+
+    @property
+    def lengths(self):
+        return np.diff(self.offsets[self.start:self.stop+1])
+
+    @property
+    def token(self):
+        ''' Identifies the library to worker processes, which open it from disk. '''
+        return ('ragged', os.path.abspath(self.path), self.start, self.stop)
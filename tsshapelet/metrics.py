@@ -1,12 +1,30 @@
-import numpy as np, psutil
-from numba import njit
-from functools import lru_cache
+import functools, numpy as np
+from .jit import njit
+from .cache import DistanceCache
+from . import instrumentation
+from .utils import as_float
 
 # --------------------------------------------------------------------------------
-# Caching memory allocation
+# Distance cache
 # --------------------------------------------------------------------------------
 
-maxsize = int(psutil.virtual_memory().total / 256)
+distance_cache = DistanceCache()
+
+def set_distance_cache(cache):
+    '''
+    Installs the cache used by `dtw` and `ed`. Pass a `DistanceCache` with a different
+    byte budget, or any object with the same `enabled`, `key`, `get` and `put` members.
+    Set `distance_cache.enabled = False` to disable caching.
+    '''
+    global distance_cache
+    distance_cache = cache
+
+
+def get_distance_cache():
+    '''
+    Returns the cache currently used by `dtw` and `ed`, e.g. to read its `stats()`.
+    '''
+    return distance_cache
 
 # --------------------------------------------------------------------------------
 # Dynamic Time Warping
@@ -36,9 +54,170 @@ def dtw_matrix(I, J, w = 0.9, r = np.inf):
     return cum_sum
 
 
-@lru_cache(maxsize=maxsize)
-def dtw_cached(I, J, w = 0.9, r = np.inf):
-    return dtw_matrix(np.array(I), np.array(J), w = w, r = r)[-1, -1]**0.5
+@njit
+def dtw_path(I, J, w = 0.9):
+    '''
+    Computes the optimal warping path between two sequences, by backtracking through the
+    cost matrix of `dtw_matrix` under the same window constraint.
+
+    Parameters:
+        I (np.ndarray): First sequence, a one-dimensional array of numerical data.
+        J (np.ndarray): Second sequence, a one-dimensional array of numerical data.
+        w (float, optional): Window constraint, as a fraction of the maximum series length. Defaults to 0.9.
+
+    Returns:
+        np.ndarray: The aligned (i, j) index pairs from (0, 0) to (len(I)-1, len(J)-1), shape = (path_length, 2).
+        Empty if the window does not allow any path.
+    '''
+    cum_sum = dtw_matrix(I, J, w)
+    n, m = len(I), len(J)
+    path = np.empty((n+m, 2), np.int64)
+
+    if cum_sum[n, m] == np.inf:
+        return path[:0]
+
+    i, j, k = n, m, 0
+    while True:
+        path[k, 0], path[k, 1] = i-1, j-1
+        k += 1
+
+        if i == 1 and j == 1:
+            break
+        elif i == 1:
+            j -= 1
+        elif j == 1:
+            i -= 1
+        else:
+            diagonal, up, left = cum_sum[i-1, j-1], cum_sum[i-1, j], cum_sum[i, j-1]
+            if diagonal <= up and diagonal <= left:
+                i, j = i-1, j-1
+            elif up <= left:
+                i -= 1
+            else:
+                j -= 1
+
+    return path[:k][::-1]
+
+
+@njit
+def dtw_distance(I, J, w = 0.9, r = np.inf):
+    '''
+    Computes the DTW distance between two sequences in linear memory.
+
+    Only two rows of the cost matrix are kept, and only the cells inside the 
+    Sakoe-Chiba band are visited. Use `dtw_matrix` when the full cost matrix 
+    (e.g. for the warping path) is required.
+
+    Parameters:
+        I (np.ndarray): First sequence, a one-dimensional array of numerical data.
+        J (np.ndarray): Second sequence, a one-dimensional array of numerical data.
+        w (float, optional): Window constraint, as a fraction of the maximum series length. Defaults to 0.9.
+        r (float, optional): Early abandon threshold. Defaults to `np.inf`.
+
+    Returns:
+        float: The DTW distance, or `np.inf` if the computation was abandoned early.
+    '''
+    return dtw_kernel(I, J, w, r)[0]
+
+
+@njit
+def dtw_kernel(I, J, w = 0.9, r = np.inf):
+    '''
+    The kernel of `dtw_distance`, also returning the number of cells it evaluated.
+    '''
+    r_squared = r**2
+    cells = 0
+    n, m = len(I), len(J)
+    window = int(max(n, m)*w)
+    prev = np.full(m+1, np.inf)
+    curr = np.full(m+1, np.inf)
+    prev[0] = 0
+
+    for i in range(1, n+1):
+
+        lo, hi = max(1, i-window), min(m, i+window)
+        if lo > hi:
+            return np.inf, cells # The band no longer reaches the end of J
+
+        curr[lo-1] = np.inf
+        row_min = np.inf
+
+        for j in range(lo, hi+1):
+
+            cost = (I[i-1] - J[j-1])**2
+            cell = cost + min(prev[j], curr[j-1], prev[j-1])
+            curr[j] = cell
+            if cell < row_min:
+                row_min = cell
+
+        if hi + 1 <= m:
+            curr[hi+1] = np.inf
+        cells += hi - lo + 1
+
+        # Early abandon if every path through the band exceeds r
+        if row_min > r_squared:
+            return np.inf, cells
+
+        prev, curr = curr, prev
+
+    return prev[m]**0.5, cells
+
+
+@njit
+def dtw_band_cells(n, m, w = 0.9):
+    '''
+    The number of cells of the cost matrix inside the Sakoe-Chiba band.
+    '''
+    window = int(max(n, m)*w)
+    cells = 0
+    for i in range(1, n+1):
+        cells += max(0, min(m, i+window) - max(1, i-window) + 1)
+    return cells
+
+
+def emit_dtw_cells(cells, band_cells, abandoned, pairs = 1):
+    '''
+    Emits the 'dtw_cells' event for `pairs` DTW distance computations at once, from the cells they
+    evaluated, the cells in their bands and the number of them abandoned early.
+    '''
+    instrumentation.emit('dtw_cells', int(cells), band_cells = int(band_cells), abandoned = int(abandoned), pairs = int(pairs))
+
+
+def dtw_instrumented(I, J, w = 0.9, r = np.inf):
+    '''
+    Computes the DTW distance, emitting the 'dtw_cells' event when instrumentation hooks are registered.
+    '''
+    if not instrumentation.hooks:
+        return dtw_distance(I, J, w = w, r = r)
+
+    dist, cells = dtw_kernel(I, J, w, r)
+    emit_dtw_cells(cells, dtw_band_cells(len(I), len(J), w), dist == np.inf)
+    return dist
+
+
+def cached_distance(metric, kernel, I, J, w = 0.9, r = np.inf, symmetric = True):
+    '''
+    Computes kernel(I, J, w, r), looking it up in and storing it to the distance cache under the
+    name of the metric. Kernels return np.inf when abandoned, so any finite distance is exact and
+    is cached, whatever the radius. The distance of a symmetric metric is shared by (I, J) and (J, I).
+    '''
+    w, r = float(w), float(r)
+    if not distance_cache.enabled:
+        return kernel(I, J, w, r)
+
+    key = distance_cache.key(metric, I, J, w, symmetric)
+    dist = distance_cache.get(key)
+
+    if instrumentation.hooks:
+        instrumentation.emit('cache_miss' if dist is None else 'cache_hit', 1, metric = metric)
+
+    if dist is None:
+        dist = kernel(I, J, w, r)
+        if dist < np.inf:
+            distance_cache.put(key, dist)
+
+    return dist
+
 
 def dtw(I, J, w = 0.9, r = np.inf):
     '''
@@ -46,8 +225,8 @@ def dtw(I, J, w = 0.9, r = np.inf):
 
     DTW measures the similarity between two temporal sequences, which may vary in speed.
     For instance, similarities in walking patterns could be detected, even if one person
-    was walking faster than the other. This function uses a cost matrix from the `dtw_matrix`
-    function to compute the square root of the final cumulative distance between the sequences,
+    was walking faster than the other. This function uses the linear-memory `dtw_distance`
+    kernel to compute the square root of the final cumulative distance between the sequences,
     providing the DTW distance.
 
     Parameters:
@@ -69,62 +248,180 @@ def dtw(I, J, w = 0.9, r = np.inf):
         >>> d(I, J)
         1.4142135623730951
     '''
-    return dtw_cached(tuple(I), tuple(J), w = w, r = r)
+    return cached_distance('dtw', dtw_instrumented, np.asarray(I), np.asarray(J), w = w, r = r)
 
 
 # --------------------------------------------------------------------------------
-# Euclidean Distance
+# Lower bounds for Dynamic Time Warping
 # --------------------------------------------------------------------------------
 
-def euclidean_distance(I, J, r = np.inf):
-    if r < np.inf:
-        dist = 0
-        for i in range(len(I)):
-            dist += (I[i] - J[i])**2
-            if dist > r:
-                return dist**0.5
-    else:
-        return np.linalg.norm(I-J) 
-    
+@njit
+def envelope(I, w = 0.9):
+    '''
+    Computes the upper and lower envelope of a sequence for LB_Keogh, using the same 
+    warping window as `dtw_distance`. Runs in linear time using monotonic queues.
 
-@lru_cache(maxsize=maxsize)
-def ed_cached(I, J, r = np.inf, w = 1):
+    Parameters:
+        I (np.ndarray): A one-dimensional array of numerical data.
+        w (float, optional): Window constraint, as a fraction of the series length. Defaults to 0.9.
 
-    I, J = np.array(I), np.array(J)
+    Returns:
+        (np.ndarray, np.ndarray): The upper and lower envelopes, each of shape = (len(I),).
+    '''
+    n = len(I)
+    radius = int(n*w)
+    U, L = np.empty(n), np.empty(n)
+    upper, lower = np.empty(n, np.int64), np.empty(n, np.int64)
+    u_head = u_tail = l_head = l_tail = 0
 
-    if w <= 0.5:
-        if type(w) not in [int, float] or 1 < w < 0:
-            raise ValueError('w must be a non-negative number between 0 and 1')
-        
-        step = int(1/w) if w != 1 else 1
-        I, J = I[::step], J[::step]
+    for k in range(n + radius):
+
+        if k < n:
+            while u_tail > u_head and I[upper[u_tail-1]] <= I[k]:
+                u_tail -= 1
+            upper[u_tail] = k
+            u_tail += 1
+
+            while l_tail > l_head and I[lower[l_tail-1]] >= I[k]:
+                l_tail -= 1
+            lower[l_tail] = k
+            l_tail += 1
+
+        i = k - radius
+        if i >= 0:
+            while upper[u_head] < i - radius:
+                u_head += 1
+            while lower[l_head] < i - radius:
+                l_head += 1
+            U[i], L[i] = I[upper[u_head]], I[lower[l_head]]
+
+    return U, L
+
+
+@njit
+def lb_kim(I, J):
+    '''
+    LB_Kim lower bound of the DTW distance. Every warping path aligns the first 
+    and the last elements of both sequences, so their costs bound the distance from below.
+    '''
+    bound = (I[0] - J[0])**2
+    if len(I) > 1 or len(J) > 1:
+        bound += (I[-1] - J[-1])**2
+    return bound**0.5
+
+
+@njit
+def lb_keogh(U, L, J, r = np.inf):
+    '''
+    LB_Keogh lower bound of the DTW distance between the sequence enclosed by the
+    envelope (U, L) and J. Only valid for sequences of equal length, with the envelope
+    computed using the same window as the DTW distance.
+
+    Parameters:
+        U (np.ndarray): Upper envelope of the first sequence.
+        L (np.ndarray): Lower envelope of the first sequence.
+        J (np.ndarray): Second sequence, of the same length as the envelope.
+        r (float, optional): Early abandon threshold. Defaults to `np.inf`.
+
+    Returns:
+        float: The lower bound, or `np.inf` if it exceeds r.
+    '''
+    r_squared = r**2
+    bound = 0.0
+    for i in range(len(J)):
+        if J[i] > U[i]:
+            bound += (J[i] - U[i])**2
+        elif J[i] < L[i]:
+            bound += (J[i] - L[i])**2
+        if bound > r_squared:
+            return np.inf
+    return bound**0.5
+
+
+# --------------------------------------------------------------------------------
+# Euclidean Distance
+# --------------------------------------------------------------------------------
+
+@njit
+def ed_distance(I, J, w = 1, r = np.inf):
+    '''
+    Computes the Euclidean distance between two sequences of the same length, with early
+    abandoning: the running sum of squares is compared against r**2, so no square root is
+    taken until the end.
+
+    Parameters:
+        I (np.ndarray): First sequence, a one-dimensional array of numerical data.
+        J (np.ndarray): Second sequence, of the same length as I.
+        w (float, optional): For w <= 0.5, the sequences are compared every int(1/w) samples. Defaults to 1.
+        r (float, optional): Early abandon threshold. Defaults to `np.inf`.
+
+    Returns:
+        float: The Euclidean distance, or `np.inf` if the computation was abandoned early.
+    '''
+    if len(I) != len(J):
+        raise ValueError('The Euclidean distance requires sequences of the same length.')
 
-    return euclidean_distance(I, J, r)
+    step = int(1/w) if w <= 0.5 else 1
+    r_squared = r**2
+    total = 0.0
+    for t in range(0, len(I), step):
+        total += (I[t] - J[t])**2
+        if total > r_squared:
+            return np.inf
+    return total**0.5
 
 
-def ed(I, J, r = np.inf, w = 1):
+@njit
+def moments(I):
+    '''
+    The mean of a sequence and the inverse of its standard deviation, or 0 for a constant sequence.
     '''
-    Calculates the Euclidean distance between two sequences, potentially utilizing caching for efficiency.
+    mean = 0.0
+    for t in range(len(I)):
+        mean += I[t]
+    mean /= len(I)
+    variance = 0.0
+    for t in range(len(I)):
+        variance += (I[t] - mean)**2
+    std = (variance / len(I))**0.5
+    return mean, 1 / std if std > 0 else 0.0
 
-    This function acts as a wrapper around a cached Euclidean distance calculation function, `ed_cached`,
-    by converting input sequences into tuples (which are hashable and can be used as keys in a cache) and
-    then calling `ed_cached` with these tuple inputs along with optional parameters for early abandonment
-    and a window size, which in the context of Euclidean distance, is typically unused but provided for
-    interface consistency.
+
+@njit
+def zed_distance(I, J, w = 1, r = np.inf):
+    '''
+    The Euclidean distance between the z-normalized sequences, computed without normalized
+    copies and abandoned early as in `ed_distance`. A constant sequence normalizes to zeros.
+    '''
+    if len(I) != len(J):
+        raise ValueError('The Euclidean distance requires sequences of the same length.')
+
+    mean_i, scale_i = moments(I)
+    mean_j, scale_j = moments(J)
+    step = int(1/w) if w <= 0.5 else 1
+    r_squared = r**2
+    total = 0.0
+    for t in range(0, len(I), step):
+        total += ((I[t] - mean_i) * scale_i - (J[t] - mean_j) * scale_j)**2
+        if total > r_squared:
+            return np.inf
+    return total**0.5
+
+
+def ed(I, J, w = 1, r = np.inf):
+    '''
+    Calculates the Euclidean distance between two sequences of the same length, using the distance cache.
 
     Parameters:
         I (Iterable): First sequence, an iterable of numerical data (e.g., list, array).
-        J (Iterable): Second sequence, an iterable of numerical data (e.g., list, array).
-        r (float, optional): Early abandonment threshold. If the cumulative distance at any point
-            exceeds this value, the computation can be stopped early. Defaults to `np.inf`, which
-            disables early abandonment.
-        w (int, optional): Window size parameter. This is included for interface consistency with
-            other distance functions but is not used in the Euclidean distance calculation. Defaults
-            to 1.
+        J (Iterable): Second sequence, of the same length as I.
+        w (float, optional): Downsampling parameter: for w <= 0.5, the sequences are compared every
+            int(1/w) samples. Defaults to 1, every sample.
+        r (float, optional): Early abandonment threshold. If the distance exceeds it, the computation
+            is stopped and `np.inf` is returned. Defaults to `np.inf`, which disables early abandonment.
 
     Returns:
-        float: The Euclidean distance between the two input sequences. If caching is enabled and
-        the distance has been previously computed, the cached value is returned.
+        float: The Euclidean distance between the two input sequences, or `np.inf` if abandoned.
 
     Examples:
         >>> I = [1, 2, 3]
@@ -132,13 +429,207 @@ def ed(I, J, r = np.inf, w = 1):
         >>> ed(I, J)
         5.196152422706632
     '''
-    return ed_cached(tuple(I), tuple(J), r, w)
+    return cached_distance('euclidean', ed_distance, np.asarray(I), np.asarray(J), w = w, r = r)
+
+
+def zed(I, J, w = 1, r = np.inf):
+    '''
+    Calculates the Euclidean distance between two sequences after z-normalizing each of them,
+    so that sequences of the same shape match regardless of offset and amplitude. The
+    parameters are those of `ed`.
+
+    Examples:
+        >>> zed([1, 2, 3], [10, 20, 30])
+        0.0
+    '''
+    return cached_distance('z_euclidean', zed_distance, np.asarray(I), np.asarray(J), w = w, r = r)
+
+
+# --------------------------------------------------------------------------------
+# Batched kernels over 2-D candidate arrays
+# --------------------------------------------------------------------------------
+
+@njit
+def dtw_rows(q, C, w = 0.9):
+    distances = np.empty(len(C))
+    for i in range(len(C)):
+        distances[i] = dtw_distance(q, C[i], w)
+    return distances
+
+
+@njit
+def dtw_rows_counted(q, C, w = 0.9):
+    '''
+    The distances of `dtw_rows`, with the cells evaluated and the cells in the bands, summed over the rows.
+    '''
+    distances = np.empty(len(C))
+    cells, band_cells = 0, 0
+    for i in range(len(C)):
+        dist, evaluated = dtw_kernel(q, C[i], w, np.inf)
+        distances[i] = dist
+        cells += evaluated
+        band_cells += dtw_band_cells(len(q), len(C[i]), w)
+    return distances, cells, band_cells
+
+
+@njit
+def ed_rows(q, C):
+    distances = np.empty(len(C))
+    for i in range(len(C)):
+        total = 0.0
+        for j in range(len(q)):
+            total += (q[j] - C[i, j])**2
+        distances[i] = total**0.5
+    return distances
+
+
+@njit
+def lb_kim_rows(q, C):
+    bounds = np.empty(len(C))
+    for i in range(len(C)):
+        bounds[i] = lb_kim(q, C[i])
+    return bounds
+
+
+@njit
+def lb_keogh_rows(U, L, C):
+    bounds = np.empty(len(C))
+    for i in range(len(C)):
+        bounds[i] = lb_keogh(U, L, C[i])
+    return bounds
+
+
+def dtw_batch(q, C, w = 0.9):
+    '''
+    Computes the DTW distance between q and every row of a 2-D array of candidates in a
+    single compiled loop, bypassing the per-pair distance cache. With instrumentation hooks
+    registered, one 'dtw_cells' event covers all the rows.
+    '''
+    if not instrumentation.hooks:
+        return dtw_rows(as_float(q), as_float(C), w)
+
+    distances, cells, band_cells = dtw_rows_counted(as_float(q), as_float(C), w)
+    emit_dtw_cells(cells, band_cells, 0, len(distances))
+    return distances
+
+
+def ed_batch(q, C, w = 1):
+    '''
+    Computes the Euclidean distance between q and every row of a 2-D array of candidates in a
+    single compiled loop, bypassing the per-pair distance cache.
+    '''
+    q, C = as_float(q), as_float(C)
+    if len(q) != C.shape[1]:
+        raise ValueError('The query and the candidates must have the same length.')
+    if w <= 0.5:
+        step = int(1/w)
+        q, C = q[::step], C[:, ::step]
+    return ed_rows(q, C)
+
+
+@njit
+def zed_rows(q, C, w = 1):
+    distances = np.empty(len(C))
+    for i in range(len(C)):
+        distances[i] = zed_distance(q, C[i], w)
+    return distances
+
+
+def zed_batch(q, C, w = 1):
+    '''
+    Computes the z-normalized Euclidean distance between q and every row of a 2-D array of
+    candidates in a single compiled loop, bypassing the per-pair distance cache.
+    '''
+    q, C = as_float(q), as_float(C)
+    if len(q) != C.shape[1]:
+        raise ValueError('The query and the candidates must have the same length.')
+    return zed_rows(q, C, float(w))
+
+
+def rows_batch(distance, q, C, w = 0.9):
+    '''
+    The batched form of a registered metric given no batched kernel: the distance from q to
+    each row of C in turn.
+    '''
+    return np.array([distance(q, c, w = w) for c in C], dtype = float)
+
+
+def is_batch(C):
+    '''
+    Whether a library is a 2-D array, e.g. the strided view from `Shapelet.windowed_extraction`,
+    which the batched kernels can process directly.
+    '''
+    return isinstance(C, np.ndarray) and C.ndim == 2
 
 
 # --------------------------------------------------------------------------------
 # Map for dynamic scoping
 # --------------------------------------------------------------------------------
 
+# Every metric is called as metrics[metric](I, J, w = w, r = r) and returns np.inf
+# when the distance exceeds r, and every batched metric as batch_metrics[metric](q, C, w = w)
+
 metrics  = {'euclidean' : ed,
+            'z_euclidean' : zed,
             'dtw' : dtw
-            }
\ No newline at end of file
+            }
+
+batch_metrics = {'euclidean' : ed_batch,
+                 'z_euclidean' : zed_batch,
+                 'dtw' : dtw_batch
+                 }
+
+
+# Registered metrics for which d(I, J) may differ from d(J, I)
+asymmetric_metrics = set()
+
+def is_symmetric(metric):
+    return metric not in asymmetric_metrics
+
+
+def register_metric(name, kernel, batch = None, symmetric = True):
+    '''
+    Registers a distance under a new metric name, for use by `query`, `query_topk`, `score`,
+    `pairwise_argmin`, `pairwise_distances` and the Shapelet extraction methods.
+
+    The kernel is called as kernel(I, J, w, r) with two 1-D float arrays, the window or
+    downsampling parameter w and an early abandon radius r, and must return the distance,
+    or np.inf once it is certain to exceed r. A numba function compiled with `njit` keeps
+    the searches fast. Results are cached in the distance cache under the metric's name.
+
+    By default the metric must be symmetric, d(I, J) == d(J, I): the distance cache shares
+    one entry between (I, J) and (J, I), and `pairwise_argmin` computes each pair once for
+    both candidates. Register an asymmetric distance with `symmetric = False`: its cache
+    entries are ordered, the sum of distances of candidate i is that of d(C[i], C[j]) over
+    j, computing every ordered pair, and `pairwise_distances` raises a ValueError.
+
+    Parameters:
+        name (str): The metric name.
+        kernel (Callable): The distance kernel.
+        batch (Callable, optional): Computes the distances from q to every row of a 2-D array,
+            called as batch(q, C, w = w). Defaults to None, calling the kernel on each row.
+        symmetric (bool, optional): Whether d(I, J) == d(J, I) for every I and J. Defaults to True.
+
+    Raises:
+        ValueError: If name is one of the built-in metrics.
+
+    Note:
+        Worker processes must see the metric too: register it before starting an `Executor`
+        or a parallel search, or at import time of a module the workers import.
+
+    Examples:
+        >>> @njit
+        ... def manhattan(I, J, w = 1, r = np.inf):
+        ...     return np.sum(np.abs(I - J))
+        >>> register_metric('manhattan', manhattan)
+        >>> query(q, C, metric = 'manhattan')
+    '''
+    if name in ('euclidean', 'z_euclidean', 'dtw'):
+        raise ValueError(f'{name!r} is a built-in metric.')
+
+    metrics[name] = functools.partial(cached_distance, name, kernel, symmetric = symmetric)
+    batch_metrics[name] = batch if batch is not None else functools.partial(rows_batch, metrics[name])
+    if symmetric:
+        asymmetric_metrics.discard(name)
+    else:
+        asymmetric_metrics.add(name)
\ No newline at end of file
@@ -0,0 +1,244 @@
+from .utils import np, as_float
+from .jit import njit
+from .metrics import dtw_kernel, dtw_band_cells, emit_dtw_cells, envelope, lb_kim, lb_keogh
+from . import instrumentation
+from .comparator import chunk_bounds, find_pool_size, process_pool
+
+# --------------------------------------------------------------------------------
+# Sliding window Euclidean distances (matrix profile style)
+# --------------------------------------------------------------------------------
+
+@njit
+def dot(T, a, b, m):
+    total = 0.0
+    for t in range(m):
+        total += np.float64(T[a+t]) * T[b+t]
+    return total
+
+
+@njit
+def diagonal_distance_sums(T, m, step, count, exclusion = 0, refresh = 256):
+    '''
+    Sums the Euclidean distances from each of `count` windows of length m, starting
+    every `step` samples, to all others. Pairs of windows are visited diagonal by
+    diagonal, updating their dot product in O(step) from the previous pair (STOMP),
+    so that only O(count) memory is used. The first `exclusion` diagonals, the trivial
+    matches, are skipped.
+    '''
+    squares = np.empty(count)
+    for k in range(count):
+        squares[k] = dot(T, k*step, k*step, m)
+
+    sums = np.zeros(count)
+    incremental = step < m
+
+    for d in range(1 + exclusion, count):
+
+        qt = 0.0
+        for k in range(count - d):
+
+            a, b = k*step, (k+d)*step
+
+            # The dot product is recomputed exactly at the start of each diagonal,
+            # periodically along it to bound rounding drift, and when the windows do not overlap
+            if k % refresh == 0 or not incremental:
+                qt = dot(T, a, b, m)
+            else:
+                for t in range(step):
+                    qt += np.float64(T[a+m-step+t]) * T[b+m-step+t] - np.float64(T[a-step+t]) * T[b-step+t]
+
+            dist = max(squares[k] + squares[k+d] - 2*qt, 0.0)**0.5
+            sums[k] += dist
+            sums[k+d] += dist
+
+    return sums
+
+
+def window_distance_sums(series, window_length = 80, step = 1, exclusion = 0):
+    '''
+    Computes, for each window extracted by `Shapelet.windowed_extraction`, the sum of its
+    Euclidean distances to all the other windows: the quantity minimized by `pairwise_argmin`
+    with the 'euclidean' metric.
+
+    Rather than computing each pair of windows independently, the dot products between windows
+    are updated along the diagonals of the distance matrix, as in STOMP. This takes O(n_windows^2 * step)
+    time and O(n_windows) memory, making exhaustive searches over series of 10^5+ samples practical.
+
+    Parameters:
+        series (np.ndarray): A one-dimensional time series.
+        window_length (int, optional): The length of the windows. Defaults to 80.
+        step (int, optional): The step size between windows. Defaults to 1.
+        exclusion (int, optional): The exclusion zone, in windows: the `exclusion` windows on either side
+            of each window are its trivial matches, and are left out of its sum. Defaults to 0.
+
+    Returns:
+        np.ndarray: The sum of distances of each window to all others, shape = (n_windows,).
+        Divide by n_windows - 1, or with an exclusion zone by the number of windows outside it, for the mean distance.
+
+    Examples:
+        >>> series = np.sin(np.linspace(0, 20, 1000))
+        >>> sums = window_distance_sums(series, window_length = 80, step = 1)
+        >>> sums.shape
+        (920,)
+    '''
+    series = as_float(series)
+    count = len(range(0, len(series) - window_length, step))
+
+    # The distances do not depend on an offset, but the dot products do: centering the series
+    # keeps them on the scale of its variations, which bounds the cancellation in |a|^2 + |b|^2 - 2 a.b
+    centered = (series - series.mean(dtype = np.float64)).astype(series.dtype) if len(series) else series
+    return diagonal_distance_sums(centered, window_length, step, count, exclusion)
+
+
+# --------------------------------------------------------------------------------
+# Shapelet transform
+# --------------------------------------------------------------------------------
+
+@njit
+def dtw_profile_min(S, U, L, T, w = 0.9):
+    '''
+    The minimum DTW distance between S and any subsequence of T of the same length. Each
+    window is screened with LB_Kim and LB_Keogh against the best distance so far, and the
+    DTW distance is abandoned once it exceeds it. Also returns, over the DTW distances
+    computed, the cells evaluated, the cells in the bands, their number and the number abandoned.
+    '''
+    m = len(S)
+    best = np.inf
+    band = dtw_band_cells(m, m, w)
+    cells, band_cells, computed, abandoned = 0, 0, 0, 0
+    for i in range(len(T) - m + 1):
+        window = T[i:i+m]
+        if lb_kim(S, window) >= best or lb_keogh(U, L, window, best) >= best:
+            continue
+        dist, evaluated = dtw_kernel(S, window, w, best)
+        cells += evaluated
+        band_cells += band
+        computed += 1
+        if dist == np.inf:
+            abandoned += 1
+        elif dist < best:
+            best = dist
+    return best, cells, band_cells, computed, abandoned
+
+
+def euclidean_profile_mins(shapelets, T):
+    '''
+    The minimum Euclidean distance between each shapelet and any subsequence of T of the
+    same length. The sliding dot products of all shapelets are computed at once by FFT
+    (MASS), and the windows within rounding error of the minimum are recomputed exactly.
+    '''
+    mins = np.full(len(shapelets), np.inf)
+    n = len(T)
+    fits = [j for j, S in enumerate(shapelets) if 0 < len(S) <= n]
+    if not fits:
+        return mins
+
+    # The distances are unchanged by a common offset, which reduces the rounding error
+    offset = T.mean()
+    T = T - offset
+    size = 1 << int(np.ceil(np.log2(n)))
+
+    padded = np.zeros((len(fits), size))
+    for row, j in enumerate(fits):
+        padded[row, :len(shapelets[j])] = shapelets[j][::-1] - offset
+    products = np.fft.irfft(np.fft.rfft(T, size) * np.fft.rfft(padded, axis = 1), size, axis = 1)
+
+    squares = np.concatenate([[0.0], np.cumsum(T**2)])
+
+    for row, j in enumerate(fits):
+        S = padded[row, :len(shapelets[j])][::-1]
+        m = len(S)
+        window_squares = squares[m:] - squares[:-m]
+        profile = window_squares - 2 * products[row, m-1:n] + np.dot(S, S)
+
+        tolerance = 1e-9 * (window_squares.max() + np.dot(S, S))
+        close = np.flatnonzero(profile <= profile.min() + tolerance)
+        windows = np.lib.stride_tricks.sliding_window_view(T, m)[close]
+        mins[j] = np.sqrt(np.min(np.sum((windows - S)**2, axis = 1)))
+
+    return mins
+
+
+def transform_rows(shapelets, series_batch, metric = 'euclidean', w = 0.9):
+
+    features = np.full((len(series_batch), len(shapelets)), np.inf)
+
+    if metric == 'dtw':
+        envelopes = [envelope(S, w) for S in shapelets]
+
+    for i, T in enumerate(series_batch):
+        T = as_float(T)
+
+        if metric == 'euclidean':
+            features[i] = euclidean_profile_mins(shapelets, T.astype(np.float64, copy = False))
+
+        elif metric == 'dtw':
+            counts = np.zeros(4, np.int64)
+            for j, S in enumerate(shapelets):
+                if 0 < len(S) <= len(T):
+                    features[i, j], *found = dtw_profile_min(S, envelopes[j][0], envelopes[j][1], T, w)
+                    counts += found
+            if instrumentation.hooks:
+                emit_dtw_cells(counts[0], counts[1], counts[3], counts[2])
+
+        else:
+            raise ValueError("metric must be 'euclidean' or 'dtw'.")
+
+    return features
+
+
+def transform_worker(args):
+    return transform_rows(*args)
+
+
+def shapelet_transform(shapelets, series_batch, metric = 'euclidean', w = 0.9, parallel_cores = 1):
+    '''
+    Computes the shapelet transform of a batch of series: the minimum distance between each
+    shapelet and any subsequence of each series of the same length as the shapelet. The result
+    is a feature matrix for classification or clustering.
+
+    With the 'euclidean' metric, the distance profiles of all shapelets against a series are
+    computed together by FFT in O(n log n) per shapelet. With 'dtw', every window is screened
+    with LB_Kim and LB_Keogh against the best distance found so far, and the banded DTW
+    distance is abandoned early once it exceeds it.
+
+    Parameters:
+        shapelets (Sequence[Sequence[float]]): The shapelets, of any lengths, e.g. `Shapelet.shapelet`
+            for several series. A single shapelet may be passed as a one-dimensional array.
+        series_batch (Sequence[Sequence[float]]): The series to transform, of any lengths. A single
+            series may be passed as a one-dimensional array.
+        metric (str, optional): 'euclidean' or 'dtw'. Defaults to 'euclidean'.
+        w (float, optional): Window constraint of the DTW distance. Defaults to 0.9.
+        parallel_cores (int, optional): The number of cores to spread the series across. Defaults to 1.
+
+    Returns:
+        np.ndarray: The minimum distances, shape = (n_series, n_shapelets). A shapelet longer than a
+        series has a distance of `np.inf` to it.
+
+    Raises:
+        ValueError: If `metric` is not 'euclidean' or 'dtw'.
+
+    Examples:
+        >>> shape.exhaustive_shapelet(window_length = 100, step = 5, verbose = False)
+        >>> X = shapelet_transform([shape.shapelet], series_batch, metric = 'euclidean')
+        >>> X.shape
+        (len(series_batch), 1)
+    '''
+    if metric not in ('euclidean', 'dtw'):
+        raise ValueError("metric must be 'euclidean' or 'dtw'.")
+
+    if len(shapelets) and np.ndim(shapelets[0]) == 0:
+        shapelets = [shapelets]
+    if len(series_batch) and np.ndim(series_batch[0]) == 0:
+        series_batch = [series_batch]
+
+    shapelets = [as_float(S) for S in shapelets]
+
+    if parallel_cores > 1:
+        pool_size = find_pool_size(parallel_cores)
+        tasks = [(shapelets, series_batch[start:stop], metric, w) for start, stop in chunk_bounds(len(series_batch), pool_size)]
+        with process_pool(pool_size) as pool:
+            results = pool.map(transform_worker, tasks)
+        return np.concatenate(results) if results else np.empty((0, len(shapelets)))
+
+    return transform_rows(shapelets, series_batch, metric, w)
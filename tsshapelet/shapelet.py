@@ -1,14 +1,20 @@
 from .utils import utils, np
+from .instrumentation import timer
 from .barycenters import barycenters
-from .comparator import pairwise_argmin
+from .comparator import pairwise_argmin, match_counts, match_means
+from .profiles import window_distance_sums
 
 class Shapelet:
     
     ''' The TimeSeries class does preprocessing, feature extraction, 
-        and shapelet extraction for 1-dimensional time series data.'''
+        and shapelet extraction for 1-dimensional time series data.
 
-    def __init__ (self, series):
-        self.series = np.array(series)
+        Passing dtype = np.float32 keeps the series, its candidates and the libraries 
+        built from them in single precision, halving their memory, and runs the numba
+        kernels on float32 inputs. Distances are still accumulated in float64.'''
+
+    def __init__ (self, series, dtype = None):
+        self.series = np.array(series, dtype = dtype)
         if self.series.ndim > 1:
             raise ValueError('The series must be one-dimensional.')
         self.shape = self.series.shape
@@ -84,7 +90,8 @@ class Shapelet:
         if (0 > factor > 1):
             raise ValueError('The factor must be between 0 and 1.')
 
-        self.series = utils['interpolate'](self.series, int(len(self.series)*factor))
+        series = utils['interpolate'](self.series, int(len(self.series)*factor))
+        self.series = series.astype(self.series.dtype, copy = False) if self.series.dtype == np.float32 else series
         return self
 
     # --------------------------------------------------------------------------------
@@ -121,7 +128,7 @@ class Shapelet:
                 self.candidates.append(candidate)
         return self
 
-    def random_extraction(self, qty, min_dist = 60, max_dist = 150):
+    def random_extraction(self, qty, min_dist = 60, max_dist = 150, exclusion = 0):
         '''
         Extracts random subsequences from the series of a random length within a range.
         
@@ -129,32 +136,64 @@ class Shapelet:
             qty (int): The number of subsequences to be extracted.
             min_dist (int): The minimum length of the subsequences.
             max_dist (int): The maximum length of the subsequences.
+            exclusion (int): The exclusion zone: subsequences centred fewer than `exclusion` samples
+                from an earlier one are redrawn, up to 10 draws per subsequence, so fewer than qty 
+                may be extracted from a short series. Defaults to 0.
         '''
         self.candidates = []
-        for _ in range(qty):
+        taken = np.zeros(len(self.series), dtype = bool)
+        for _ in range(qty * 10 if exclusion else qty):
+            if len(self.candidates) == qty:
+                break
             index = np.random.randint(max_dist, len(self.series)-max_dist)
             length = np.random.randint(min_dist, max_dist) if min_dist != max_dist else max_dist
+            if exclusion:
+                if taken[index]:
+                    continue
+                taken[max(0, index-exclusion+1) : index+exclusion] = True
             self.candidates.append(self.series[index-length//2 : index+length//2])
         return self
 
     def windowed_extraction(self, window_length = 80, step = 1):
         '''
         Extracts subsequences from the series of a fixed length with a fixed step size.
+        The candidates are a read-only, zero-copy 2-D strided view of the series, 
+        shape = (n_windows, window_length). The shapelet selected from them is a copy.
         
         Parameters
             window_length (int): The length of the subsequences.
             step (int): The step size between subsequences.
         '''
-        self.candidates = []
-        for i in np.arange(0, len(self.series) - window_length, step):
-            self.candidates.append(self.series[i:i+window_length])
+        if len(self.series) <= window_length:
+            self.candidates = np.empty((0, window_length), dtype = self.series.dtype)
+        else:
+            windows = np.lib.stride_tricks.sliding_window_view(self.series, window_length)
+            self.candidates = windows[:len(self.series) - window_length:step]
+        return self
+
+    def deduplicate(self, segments = 8, tolerance = 0.1):
+        '''
+        Drops near-duplicate candidates, such as overlapping windows of a smooth series. Each 
+        candidate is reduced by PAA to `segments` means, quantized to bins of `tolerance` standard 
+        deviations, and only the first candidate of each code is kept, in linear time.
+
+        Parameters
+            segments (int): The number of PAA segments hashed. Defaults to 8.
+            tolerance (float): The bin width, in standard deviations of the reduced candidates. 
+                Larger values merge more candidates. Defaults to 0.1.
+        '''
+        kept = utils['deduplicate'](self.candidates, segments, tolerance)
+        if isinstance(self.candidates, np.ndarray):
+            self.candidates = self.candidates[kept]
+        else:
+            self.candidates = [self.candidates[i] for i in kept]
         return self
     
     # --------------------------------------------------------------------------------
     # Shapelet extraction
     # --------------------------------------------------------------------------------
 
-    def random_shapelet(self, qty = 1000, min_dist = 60, max_dist = 150, parallel_cores = 1, w = 0.9, metric = 'dtw', verbose = True):
+    def random_shapelet(self, qty = 1000, min_dist = 60, max_dist = 150, parallel_cores = 1, w = 0.9, metric = 'dtw', verbose = True, executor = None, approximate = False, exclusion = 0, dedup = None):
         '''
         Extracts a specified quantity of random shapelet candidates from the dataset, selects the one with the minimum pairwise 
         distance to all others based on a given distance metric, and assigns it as the shapelet for this instance.
@@ -171,6 +210,12 @@ class Shapelet:
             w (float, optional): The window size parameter for the distance function, used when `metric` is 'dtw'. Defaults to 0.9.
             metric (str, optional): The distance metric to use for computing pairwise distances. Defaults to 'dtw'.
             verbose (bool, optional): If True, prints the progress and results of the extraction and selection process. Defaults to True.
+            executor (Executor, optional): A persistent worker pool for computing pairwise distances. Overrides `parallel_cores`. Defaults to None.
+            approximate (bool, optional): If True, the candidate is selected by the sampled search of `pairwise_argmin(approximate = True)`,
+                which needs far fewer distance computations for large `qty`. Defaults to False.
+            exclusion (int, optional): The minimum number of samples between the centres of two candidates, as in `random_extraction`. Defaults to 0.
+            dedup (float, optional): If given, near-duplicate candidates are dropped by `deduplicate(tolerance = dedup)` before
+                the pairwise search. Defaults to None.
 
         Note: The effectiveness of the selected shapelet for tasks such as time series classification or clustering depends on the characteristics
         of the dataset and the specified parameters.
@@ -178,23 +223,27 @@ class Shapelet:
         if verbose:
             print(f'Extracting {qty} random candidates of a random length in the range: ({min_dist}, {max_dist})')
 
-        self.random_extraction(qty, min_dist, max_dist)
+        with timer('extraction', method = 'random_shapelet'):
+            self.random_extraction(qty, min_dist, max_dist, exclusion)
+            if dedup is not None:
+                self.deduplicate(tolerance = dedup)
 
         if verbose:
-            print(f'Calculating pairwise distances between {qty} candidates')
+            print(f'Calculating pairwise distances between {len(self.candidates)} candidates')
 
-        index = pairwise_argmin(self.candidates, w = w, metric = metric, parallel_cores = parallel_cores)
+        with timer('pairwise', method = 'random_shapelet'):
+            index = pairwise_argmin(self.candidates, w = w, metric = metric, parallel_cores = parallel_cores, executor = executor, approximate = approximate)
 
         if verbose:
             print(f'Candidate {index} has the minimum pairwise distance')
 
-        self.shapelet = self.candidates[index]
+        self.shapelet = np.array(self.candidates[index])
 
         if verbose:
             print('Access the random shapelet using the .shapelet attribute')
 
 
-    def exhaustive_shapelet(self, window_length = 80, step = 1, w = 0.9, metric = 'dtw', parallel_cores = 1, verbose = True):
+    def exhaustive_shapelet(self, window_length = 80, step = 1, w = 0.9, metric = 'dtw', parallel_cores = 1, verbose = True, executor = None, levels = 1, keep = 0.1, exclusion = 0, dedup = None):
         '''
         Performs an exhaustive search for the best shapelet within the series by extracting all possible subsequences using a sliding window approach, 
         then selects the shapelet with the minimum pairwise distance based on the specified distance metric.
@@ -206,31 +255,61 @@ class Shapelet:
             metric (str, optional): The distance metric to use for computing pairwise distances between subsequences. Supports 'dtw' (Dynamic Time Warping) and 'euclidean' (Euclidean distance). Defaults to 'dtw'.
             parallel_cores (int, optional): The number of cores to use for parallel computation of pairwise distances. Defaults to 1.
             verbose (bool, optional): If True, prints informative messages about the progress of shapelet extraction and selection. Defaults to True.
+            executor (Executor, optional): A persistent worker pool for computing pairwise distances. Overrides `parallel_cores`. Defaults to None.
+            levels (int, optional): If greater than 1, the candidates are pruned coarse to fine over this many resolutions, as in
+                `pairwise_argmin(levels = ...)`. Defaults to 1.
+            keep (float, optional): The fraction of the candidates kept at each finer level. Defaults to 0.1.
+            exclusion (int, optional): The exclusion zone, in samples: windows starting at most `exclusion` samples apart are
+                trivial matches and are not compared, and windows are ranked by their mean distance to the others, as in
+                `pairwise_argmin(exclusion = ...)`. window_length // 2 is a common choice. Defaults to 0.
+            dedup (float, optional): If given, near-duplicate windows are dropped by `deduplicate(tolerance = dedup)` before
+                the pairwise search, which no longer uses `window_distance_sums`. Defaults to None.
+
+        Raises
+            ValueError: If both `exclusion` and `dedup` are given, as the positions of the windows are lost by deduplication.
 
         Note
             The choice of `window_length` and `step` parameters can significantly affect the computational cost and the quality of the extracted shapelet. 
             Smaller steps increase the resolution of the search but require more computation.
+
+            With the 'euclidean' metric (and w > 0.5, where the windows are not downsampled), the pairwise distances are computed 
+            by `window_distance_sums`, which updates the dot products between sliding windows rather than comparing each pair of 
+            windows independently.
         '''
+        if exclusion and dedup is not None:
+            raise ValueError('An exclusion zone cannot be combined with deduplication.')
+
+        # The exclusion zone in windows
+        zone = exclusion // step
+
         if verbose:
             print(f'Extracting candidates from the series using a sliding window of length {window_length} and step {step}')
 
-        self.windowed_extraction(window_length, step)
+        with timer('extraction', method = 'exhaustive_shapelet'):
+            self.windowed_extraction(window_length, step)
+            if dedup is not None:
+                self.deduplicate(tolerance = dedup)
 
         if verbose:
             print(f'Calculating pairwise distances between {len(self.candidates)} candidates')
 
-        index = pairwise_argmin(self.candidates, w = w, metric = metric, parallel_cores = parallel_cores)
+        with timer('pairwise', method = 'exhaustive_shapelet'):
+            if metric == 'euclidean' and w > 0.5 and levels == 1 and dedup is None:
+                sums = window_distance_sums(self.series, window_length, step, zone)
+                index = int(np.argmin(match_means(sums, match_counts(len(sums), zone))))
+            else:
+                index = pairwise_argmin(self.candidates, w = w, metric = metric, parallel_cores = parallel_cores, executor = executor, levels = levels, keep = keep, exclusion = zone)
 
         if verbose:
             print(f'Candidate {index} has the minimum pairwise distance')
 
-        self.shapelet = self.candidates[index]
+        self.shapelet = np.array(self.candidates[index])
 
         if verbose:
             print('Access the exhaustive shapelet using the .shapelet attribute')
 
 
-    def barycenter_shapelet(self, min_dist = 60, thres = 0.6, max_dist = 150, barycenter = 'interpolated', verbose = True):
+    def barycenter_shapelet(self, min_dist = 60, thres = 0.6, max_dist = 150, barycenter = 'interpolated', verbose = True, **barycenter_params):
         '''
         Extracts shapelet candidates from the series using peak extraction based on specified parameters and then computes a 
         barycenter shapelet from these candidates. The barycenter represents a 'central' shapelet that summarizes the set of candidates.
@@ -239,8 +318,9 @@ class Shapelet:
             min_dist (int, optional): The minimum distance between peaks to be considered separate candidates during peak extraction. Defaults to 60.
             thres (float, optional): The threshold value for peak extraction, used to determine the significance of peaks. Defaults to 0.6.
             max_dist (int, optional): The maximum distance considered for peak extraction. This parameter can limit the search space for peaks. Defaults to 150.
-            barycenter (str, optional): The method used to calculate the barycenter from the set of candidates. Supports 'interpolated' or other predefined methods in the `barycenters` dictionary. Defaults to 'interpolated'.
+            barycenter (str, optional): The method used to calculate the barycenter from the set of candidates. Supports 'interpolated', 'average', 'dba' or other predefined methods in the `barycenters` dictionary. Defaults to 'interpolated'.
             verbose (bool, optional): If True, prints informative messages about the progress of shapelet extraction and barycenter creation. Defaults to True.
+            **barycenter_params: Passed on to the barycenter method, e.g. `w`, `max_iter`, `tol` and `parallel_cores` for 'dba'.
 
         Note
             This shapelet method is especially effective for cyclical time series data.
@@ -248,12 +328,14 @@ class Shapelet:
         if verbose:
             print(f'Extracting candidates from the series using peak extraction with a minimum distance of {min_dist} and a threshold of {thres}')
 
-        self.peak_extraction(min_dist, thres, max_dist)
+        with timer('extraction', method = 'barycenter_shapelet'):
+            self.peak_extraction(min_dist, thres, max_dist)
 
         if verbose:
             print(f'Creating a barycenter from {len(self.candidates)} candidates')
 
-        self.shapelet =  barycenters[barycenter](self.candidates)
+        with timer('barycenter', method = 'barycenter_shapelet'):
+            self.shapelet =  barycenters[barycenter](self.candidates, **barycenter_params)
         
         if verbose:
             print('Access the barycenter shapelet using the .shapelet attribute')
\ No newline at end of file
@@ -0,0 +1,156 @@
+from .utils import utils, np
+from .shapelet import Shapelet
+from collections import deque
+
+class StreamingShapelet:
+
+    ''' The StreamingShapelet class maintains a barycenter shapelet over a stream of
+        samples pushed in chunks. Samples are held in a bounded ring buffer, the
+        normalization statistics are kept as running moments, peaks are detected
+        incrementally, and the barycenter is updated as each new cycle completes, so
+        each update costs O(chunk size + buffer capacity) rather than O(total length).'''
+
+    def __init__(self, capacity = 10000, min_dist = 60, thres = 0.6, max_dist = 150, normalization = 'z', max_candidates = 100):
+        '''
+        Parameters:
+            capacity (int, optional): The number of most recent samples kept in the ring buffer. Defaults to 10000.
+            min_dist (int, optional): The minimum distance between peaks, as in `Shapelet.peak_extraction`. Defaults to 60.
+            thres (float, optional): The quantile of the buffered samples a peak must reach. Defaults to 0.6.
+            max_dist (int, optional): The maximum length of a cycle between two peaks. Defaults to 150.
+            normalization (str, optional): 'z' to z-normalize each cycle with the running mean and standard
+                deviation of the stream, or None. Defaults to 'z'.
+            max_candidates (int, optional): The number of most recent cycles kept in the .candidates attribute. Defaults to 100.
+        '''
+        if capacity <= 2 * (max_dist + min_dist):
+            raise ValueError('The capacity must exceed twice the sum of min_dist and max_dist.')
+        if normalization not in ('z', None):
+            raise ValueError("normalization must be 'z' or None.")
+
+        self.capacity = capacity
+        self.min_dist = min_dist
+        self.thres = thres
+        self.max_dist = max_dist
+        self.normalization = normalization
+
+        self.buffer = np.zeros(capacity)
+        self.total = 0 # number of samples seen, i.e. the absolute index of the next sample
+
+        # Running moments of the stream
+        self.mean = 0.0
+        self.m2 = 0.0
+
+        # Incremental peak detection
+        self.scanned = 0 # absolute index before which peaks are final
+        self.last_peak = None
+
+        # Incremental barycenter, accumulated at a fixed reference length
+        self.reference_length = max_dist
+        self.cycle_sum = np.zeros(self.reference_length)
+        self.length_sum = 0
+        self.cycles = 0
+        self.candidates = deque(maxlen = max_candidates)
+        self.shapelet = None
+
+    @property
+    def std(self):
+        return (self.m2 / self.total)**0.5 if self.total else 0.0
+
+    @property
+    def series(self):
+        ''' The buffered samples, oldest first. '''
+        return self.window(max(0, self.total - self.capacity), self.total)
+
+    def window(self, start, stop):
+        '''
+        Returns the samples at absolute indexes [start, stop) of the stream. They must
+        still be held in the ring buffer.
+        '''
+        if start < self.total - self.capacity:
+            raise IndexError('The requested samples have left the ring buffer.')
+        return self.buffer[np.arange(start, stop) % self.capacity]
+
+    def to_shapelet(self):
+        ''' Returns a Shapelet of the buffered samples, for the batch methods. '''
+        return Shapelet(self.series)
+
+    # --------------------------------------------------------------------------------
+    # Ingestion
+    # --------------------------------------------------------------------------------
+
+    def update(self, chunk):
+        '''
+        Pushes a chunk of samples into the stream, updating the normalization statistics, the detected
+        peaks and the barycenter shapelet. Chunks longer than half the capacity are ingested in pieces.
+
+        Parameters:
+            chunk (Sequence[float]): The new samples.
+        '''
+        chunk = np.asarray(chunk, dtype = float).ravel()
+        piece = self.capacity // 2
+        for start in range(0, len(chunk), piece):
+            self.ingest(chunk[start:start + piece])
+        return self
+
+    def ingest(self, chunk):
+        n = len(chunk)
+        if n == 0:
+            return
+
+        # Chan et al. update of the running mean and sum of squared deviations
+        chunk_mean = chunk.mean()
+        chunk_m2 = np.sum((chunk - chunk_mean)**2)
+        delta = chunk_mean - self.mean
+        total = self.total + n
+        self.mean += delta * n / total
+        self.m2 += chunk_m2 + delta**2 * self.total * n / total
+
+        indexes = np.arange(self.total, total) % self.capacity
+        self.buffer[indexes] = chunk
+        self.total = total
+
+        self.detect_peaks()
+
+    def detect_peaks(self):
+        '''
+        Runs peak detection over the samples that arrived since the last update, with min_dist samples of
+        context on the left. A peak is final once min_dist samples have arrived after it, since no higher
+        peak can then suppress it.
+        '''
+        final = self.total - self.min_dist
+        if final <= self.scanned:
+            return
+
+        buffered = self.series
+        height = np.quantile(buffered, self.thres)
+        origin = self.total - len(buffered)
+
+        start = max(origin, self.scanned - self.min_dist)
+        segment = buffered[start - origin:]
+        peaks = utils['find_peaks'](segment, min_dist = self.min_dist, thres = 0) if len(segment) > 2 else []
+
+        for peak in np.asarray(peaks) + start:
+            if not self.scanned <= peak < final or segment[peak - start] < height:
+                continue
+            if self.last_peak is not None and peak - self.last_peak < self.min_dist:
+                continue
+            if self.last_peak is not None and self.last_peak >= origin:
+                self.add_cycle(self.window(self.last_peak, peak))
+            self.last_peak = peak
+
+        self.scanned = final
+
+    def add_cycle(self, cycle):
+        ''' Folds a completed cycle into the barycenter shapelet. '''
+        if not self.min_dist <= len(cycle) <= self.max_dist:
+            return
+
+        if self.normalization == 'z' and self.std > 0:
+            cycle = (cycle - self.mean) / self.std
+
+        self.candidates.append(cycle)
+        self.cycle_sum += utils['interpolate'](cycle, self.reference_length)
+        self.length_sum += len(cycle)
+        self.cycles += 1
+
+        length = int(self.length_sum / self.cycles)
+        self.shapelet = utils['interpolate'](self.cycle_sum / self.cycles, length)
@@ -0,0 +1,217 @@
+from .utils import np, as_float, pack
+from .jit import njit, prange, fork_safe_threads
+from .library import RaggedLibrary
+from .metrics import dtw_kernel, dtw_band_cells, ed_distance, emit_dtw_cells, envelope, lb_kim, lb_keogh
+from . import instrumentation
+from contextlib import contextmanager
+
+# --------------------------------------------------------------------------------
+# Thread-parallel kernels over packed libraries
+# --------------------------------------------------------------------------------
+
+# The kernels run on a library packed by utils['pack'] into a flat buffer of values and
+# offsets, where series i spans values[offsets[i]:offsets[i+1]], and release the GIL so
+# that their threads share the library and the parent's memory with no serialization.
+
+@njit(nogil = True)
+def pair_distance(I, J, w = 0.9, euclidean = False, r = np.inf):
+    '''
+    The distance of `metrics[metric](I, J, w = w, r = r)`, inside a kernel: the banded DTW
+    distance, or the Euclidean distance, downsampled as in `ed` when w <= 0.5. Also returns
+    the DTW cells evaluated and the cells in the band, both 0 for the Euclidean distance.
+    '''
+    if euclidean:
+        return ed_distance(I, J, w, r), 0, 0
+    dist, cells = dtw_kernel(I, J, w, r)
+    return dist, cells, dtw_band_cells(len(I), len(J), w)
+
+
+@njit(nogil = True, parallel = True)
+def score_packed(q, values, offsets, w = 0.9, euclidean = False):
+    '''
+    The distances from q to every series, and per series, the DTW cells evaluated and in the band.
+    '''
+    n = len(offsets) - 1
+    scores = np.empty(n)
+    cells = np.zeros((n, 2), np.int64)
+    for i in prange(n):
+        dist, evaluated, band = pair_distance(q, values[offsets[i]:offsets[i+1]], w, euclidean, np.inf)
+        scores[i] = dist
+        cells[i, 0] = evaluated
+        cells[i, 1] = band
+    return scores, cells
+
+
+@njit(nogil = True, parallel = True)
+def query_packed(q, values, offsets, w = 0.9, euclidean = False, chunks = 1):
+    '''
+    Nearest neighbour search in parallel chunks, each searched sequentially with its own
+    best distance as the early abandon radius and, for DTW, the lower bound cascade of `query`.
+    Returns the index and distance of the best match and the counters of `query_stats`,
+    as [lb_kim, lb_keogh, lb_keogh_reversed, dtw, abandoned], followed by the DTW cells
+    evaluated and in the bands.
+    '''
+    n = len(offsets) - 1
+    size = (n + chunks - 1) // chunks
+    best_index = np.full(chunks, -1, np.int64)
+    best_dist = np.full(chunks, np.inf)
+    counters = np.zeros((chunks, 7), np.int64)
+    U, L = envelope(q, w)
+
+    for chunk in prange(chunks):
+        radius = np.inf
+        for i in range(chunk * size, min(n, (chunk + 1) * size)):
+            c = values[offsets[i]:offsets[i+1]]
+
+            if not euclidean and best_index[chunk] >= 0:
+                if lb_kim(q, c) >= radius:
+                    counters[chunk, 0] += 1
+                    continue
+                if len(c) == len(q):
+                    if lb_keogh(U, L, c, radius) >= radius:
+                        counters[chunk, 1] += 1
+                        continue
+                    c_upper, c_lower = envelope(c, w)
+                    if lb_keogh(c_upper, c_lower, q, radius) >= radius:
+                        counters[chunk, 2] += 1
+                        continue
+
+            dist, evaluated, band = pair_distance(q, c, w, euclidean, radius)
+            counters[chunk, 3] += 1
+            counters[chunk, 5] += evaluated
+            counters[chunk, 6] += band
+            if dist == np.inf:
+                counters[chunk, 4] += 1
+            elif best_index[chunk] < 0 or dist < radius:
+                best_index[chunk] = i
+                best_dist[chunk] = dist
+                radius = dist
+
+    best = -1
+    for chunk in range(chunks):
+        if best_index[chunk] >= 0 and (best < 0 or best_dist[chunk] < best_dist[best]):
+            best = chunk
+
+    totals = np.zeros(7, np.int64)
+    for chunk in range(chunks):
+        totals += counters[chunk]
+
+    if best < 0:
+        return -1, np.inf, totals
+    return best_index[best], best_dist[best], totals
+
+
+@njit(nogil = True, parallel = True)
+def row_sums_packed(values, offsets, w = 0.9, euclidean = False, threads = 1, exclusion = 0):
+    '''
+    The sum of the distances from each series to all others, computing each pair once and
+    skipping pairs less than `exclusion` + 1 positions apart. Each thread takes every threads-th
+    pair of rows (i, n - 1 - i), so that all threads cover about the same number of pairs, and
+    accumulates into its own row of partial sums. Also returns the DTW cells evaluated and in
+    the bands, summed over the pairs.
+    '''
+    n = len(offsets) - 1
+    partial = np.zeros((threads, n))
+    cells = np.zeros((threads, 2), np.int64)
+
+    for thread in prange(threads):
+        for k in range(thread, (n + 1) // 2, threads):
+            for side in range(2):
+                i = k if side == 0 else n - 1 - k
+                if side == 1 and i == k:
+                    continue
+                I = values[offsets[i]:offsets[i+1]]
+                for j in range(i + 1 + exclusion, n):
+                    dist, evaluated, band = pair_distance(I, values[offsets[j]:offsets[j+1]], w, euclidean, np.inf)
+                    cells[thread, 0] += evaluated
+                    cells[thread, 1] += band
+                    partial[thread, i] += dist
+                    partial[thread, j] += dist
+
+    sums = np.zeros(n)
+    for thread in range(threads):
+        sums += partial[thread]
+    totals = np.zeros(2, np.int64)
+    for thread in range(threads):
+        totals += cells[thread]
+    return sums, totals
+
+
+# --------------------------------------------------------------------------------
+# Thread backend
+# --------------------------------------------------------------------------------
+
+@contextmanager
+def thread_pool(parallel_cores):
+    '''
+    Sets the number of numba threads for the duration of a call, within the limit of
+    NUMBA_NUM_THREADS, restoring the previous number afterwards. The threads are started
+    under a threading layer that process pools can still be forked after, see `jit.fork_safe_threads`.
+    '''
+    import numba
+    fork_safe_threads()
+    previous = numba.get_num_threads()
+    threads = max(1, min(parallel_cores, numba.config.NUMBA_NUM_THREADS))
+    numba.set_num_threads(threads)
+    try:
+        yield threads
+    finally:
+        numba.set_num_threads(previous)
+
+
+def packed_library(C, metric = 'dtw', length = None):
+    '''
+    Packs a library for the thread kernels, checking that the metric is supported and,
+    for 'euclidean', that every series has the given length. A RaggedLibrary is not
+    copied: its memory-mapped values are sliced, so pages are still loaded on demand.
+    '''
+    if metric not in ('dtw', 'euclidean'):
+        raise ValueError("The thread backend supports the 'dtw' and 'euclidean' metrics.")
+
+    if isinstance(C, RaggedLibrary):
+        offsets = np.array(C.offsets[C.start:C.stop+1], dtype = np.int64)
+        values = np.asarray(C.values[offsets[0]:offsets[-1]])
+        offsets -= offsets[0]
+    else:
+        values, offsets = pack(C)
+    if metric == 'euclidean' and len(offsets) > 1:
+        lengths = np.diff(offsets)
+        if np.any(lengths != (lengths[0] if length is None else length)):
+            raise ValueError('The Euclidean distance requires series of the same length.')
+    return values, offsets
+
+
+def thread_score(q, C, metric = 'dtw', w = 0.9, parallel_cores = 1):
+    q = as_float(q)
+    values, offsets = packed_library(C, metric, len(q))
+    with thread_pool(parallel_cores):
+        scores, cells = score_packed(q, values, offsets, float(w), metric == 'euclidean')
+    if instrumentation.hooks and metric == 'dtw':
+        emit_dtw_cells(cells[:, 0].sum(), cells[:, 1].sum(), 0, len(scores))
+    return scores
+
+
+def thread_query(q, C, w = 0.9, metric = 'dtw', parallel_cores = 1, stats = None):
+    q = as_float(q)
+    values, offsets = packed_library(C, metric, len(q))
+    with thread_pool(parallel_cores) as threads:
+        chunks = max(1, min(len(C), 4 * threads))
+        index, _, counters = query_packed(q, values, offsets, float(w), metric == 'euclidean', chunks)
+
+    if stats is not None:
+        for key, value in zip(('lb_kim', 'lb_keogh', 'lb_keogh_reversed', 'dtw', 'abandoned'), counters):
+            stats[key] += int(value)
+    if instrumentation.hooks and metric == 'dtw':
+        emit_dtw_cells(counters[5], counters[6], counters[4], counters[3])
+
+    return int(index) if index >= 0 else None
+
+
+def thread_row_sums(C, metric = 'dtw', w = 0.9, parallel_cores = 1, exclusion = 0):
+    values, offsets = packed_library(C, metric)
+    with thread_pool(parallel_cores) as threads:
+        sums, cells = row_sums_packed(values, offsets, float(w), metric == 'euclidean', threads, exclusion)
+    if instrumentation.hooks and metric == 'dtw':
+        n = len(offsets) - 1
+        emit_dtw_cells(cells[0], cells[1], 0, max(0, n - 1 - exclusion) * max(0, n - exclusion) // 2)
+    return sums
@@ -1,10 +1,8 @@
 import numpy as np
-from scipy.interpolate import interp1d
-from scipy.signal import find_peaks
 
 def interpolate(array, length):
     array_length = len(array)
-    return interp1d(np.arange(0, array_length), array)(np.linspace(0.0, array_length-1, length))
+    return np.interp(np.linspace(0.0, array_length-1, length), np.arange(0, array_length), array)
 
 def reinterpolate(array, window_length):
     length = len(array)
@@ -14,11 +12,75 @@ def pad(array, length):
     return np.pad(array, (0,length - len(array)), 'constant')
 
 def indexes(array, min_dist = 60, thres = 0.9):
+    from scipy.signal import find_peaks # imported on first use, as scipy.signal is slow to import
     return find_peaks(array, height=np.quantile(array, thres), distance=min_dist)[0]
+
+def as_float(array):
+    '''
+    Converts to a float array for the numba kernels, keeping float32 input in float32 rather than
+    upcasting it, so that the kernels are specialized for it.
+    '''
+    array = np.asarray(array)
+    return array if array.dtype in (np.float32, np.float64) else array.astype(np.float64)
+
+def float_dtype(C):
+    '''
+    The dtype a collection of time series is stored in: float32 if every series is float32, else float64.
+    '''
+    if isinstance(C, np.ndarray):
+        return np.dtype(np.float32 if C.dtype == np.float32 else np.float64)
+    single = len(C) > 0 and all(getattr(c, 'dtype', None) == np.float32 for c in C)
+    return np.dtype(np.float32 if single else np.float64)
+
+def paa(C, segments):
+    '''
+    Piecewise aggregate approximation: reduces each time series to the means of `segments` 
+    segments of (nearly) equal length, shape = (n_instances, segments). Series of any lengths 
+    are reduced to the same number of segments.
+    '''
+    if isinstance(C, np.ndarray) and C.ndim == 2:
+        starts = np.linspace(0, C.shape[1], segments + 1).astype(np.int64)
+        return np.add.reduceat(C, starts[:-1], axis = 1) / np.diff(starts)
+    reduced = np.empty((len(C), segments))
+    for i, c in enumerate(C):
+        starts = np.linspace(0, len(c), segments + 1).astype(np.int64)
+        reduced[i] = np.add.reduceat(np.asarray(c, dtype = float), starts[:-1]) / np.diff(starts)
+    return reduced
+
+def deduplicate(C, segments = 8, tolerance = 0.1):
+    '''
+    The indices of the time series left once near-duplicates are dropped, in order. Each series is
+    reduced by PAA to `segments` means, quantized to bins of `tolerance` standard deviations of the
+    reduced values, and only the first series of each distinct code is kept. This is a linear-time
+    hash: series a little under a bin width apart may still land in neighbouring bins.
+    '''
+    if len(C) == 0:
+        return np.arange(0)
+    length = C.shape[1] if isinstance(C, np.ndarray) and C.ndim == 2 else min(len(c) for c in C)
+    reduced = paa(C, max(1, min(segments, length)))
+    width = tolerance * np.std(reduced)
+    codes = np.floor(reduced / width).astype(np.int64) if width > 0 else np.zeros(reduced.shape, np.int64)
+    return np.sort(np.unique(codes, axis = 0, return_index = True)[1])
+
+def pack(C):
+    '''
+    Packs a collection of time series into a flat array of values and an array of offsets,
+    where series i spans values[offsets[i]:offsets[i+1]]. A C-contiguous 2-D array is packed without copying.
+    The values are float32 if every series is float32, else float64.
+    '''
+    dtype = float_dtype(C)
+    if isinstance(C, np.ndarray) and C.ndim == 2 and C.dtype == dtype and C.flags.c_contiguous:
+        return C.reshape(-1), np.arange(len(C) + 1, dtype = np.int64) * C.shape[1]
+    offsets = np.concatenate([[0], np.cumsum([len(c) for c in C])]).astype(np.int64)
+    values = np.concatenate([np.asarray(c, dtype = dtype) for c in C]) if len(C) else np.empty(0, dtype)
+    return values, offsets
          
 
 utils = {'interpolate' : interpolate,
          'reinterpolate' : reinterpolate,
          'pad' : pad,
-         'find_peaks' : indexes
+         'find_peaks' : indexes,
+         'pack' : pack,
+         'paa' : paa,
+         'deduplicate' : deduplicate
          }
\ No newline at end of file